@@ -0,0 +1,141 @@
+import functools
+
+import numpy as np
+
+
+def _is_tensor(x):
+    return type(x).__module__.startswith("torch")
+
+
+def to_db(power, top_db=80.0, amin=1e-10):
+    """
+    Power spectrogram(s) (..., bins, frames) in dB relative to each signal's
+    own maximum, floored at -top_db: librosa.power_to_db(ref=np.max) applied
+    to every leading index separately.
+    """
+    db = 10 * np.log10(np.maximum(amin, np.asarray(power)))
+    db -= db.max(axis=(-2, -1), keepdims=True)
+    return np.maximum(db, -top_db)
+
+
+def default_n_fft(sr):
+    """~93 ms frames at any rate: 2048 at 22.05 kHz, 4096 at 44.1/48 kHz."""
+    return 2048 * max(1, round(sr / 22050))
+
+
+class SignalAnalysis:
+    """
+    Time-frequency analysis of one signal. The STFT is computed once, on first
+    use, and everything derived from it (magnitude, phase, power, mel power,
+    dB, average spectrum) is computed lazily and memoized on the instance.
+
+    `y` is a (..., n_samples) numpy array or torch tensor; leading dimensions
+    (stems, channels) are transformed together. Tensors stay tensors, so the
+    StemMixer can use the same object as the visualizations.
+    """
+
+    def __init__(self, y, sr, n_fft=None, hop_length=None):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft or default_n_fft(sr)
+        self.hop_length = hop_length or self.n_fft // 4
+        self._mel = {}
+
+    @classmethod
+    def from_file(cls, audio_path, sr=None, mono=True, **kwargs):
+        """Decodes `audio_path` (native rate unless `sr` is given) and wraps it."""
+        import librosa
+
+        y, sr = librosa.load(audio_path, sr=sr, mono=mono)
+        return cls(y, sr, **kwargs)
+
+    @functools.cached_property
+    def window(self):
+        if _is_tensor(self.y):
+            import torch
+            return torch.hann_window(self.n_fft, device=self.y.device)
+        import scipy.signal
+        return scipy.signal.get_window("hann", self.n_fft).astype(np.float32)
+
+    @functools.cached_property
+    def stft(self):
+        """Complex STFT, shape (..., 1 + n_fft // 2, n_frames), centred frames."""
+        if _is_tensor(self.y):
+            import torch
+
+            lead, length = self.y.shape[:-1], self.y.shape[-1]
+            S = torch.stft(self.y.reshape(-1, length), self.n_fft, self.hop_length,
+                           window=self.window, return_complex=True)
+            return S.reshape(*lead, *S.shape[-2:])
+        import librosa
+
+        return librosa.stft(np.asarray(self.y), n_fft=self.n_fft, hop_length=self.hop_length,
+                            window=self.window)
+
+    @functools.cached_property
+    def magnitude(self):
+        return abs(self.stft)
+
+    @functools.cached_property
+    def phase(self):
+        return self.stft.angle() if _is_tensor(self.stft) else np.angle(self.stft)
+
+    @functools.cached_property
+    def power(self):
+        return self.magnitude ** 2
+
+    @functools.cached_property
+    def freqs(self):
+        return np.fft.rfftfreq(self.n_fft, 1 / self.sr)
+
+    @functools.cached_property
+    def avg_power(self):
+        """Power spectrum averaged over frames (Welch-style), shape (..., 1 + n_fft // 2)."""
+        return self.power.mean(-1)
+
+    @functools.cached_property
+    def psd(self):
+        """One-sided power spectral density of avg_power (scipy.signal.welch scaling)."""
+        return self.density(self.avg_power)
+
+    def density(self, avg_power):
+        """PSD scaling of a frame-averaged power spectrum computed with this analysis' window."""
+        window = np.asarray(self.window, dtype=np.float64)
+        psd = np.asarray(avg_power, dtype=np.float64) / (self.sr * np.sum(window ** 2))
+        psd[..., 1:-1] *= 2
+        return psd
+
+    @functools.cached_property
+    def power_db(self):
+        return to_db(self.power)
+
+    def mel_power(self, n_mels=128, fmax=None):
+        """Mel-band power, memoized per (n_mels, fmax)."""
+        key = (n_mels, fmax)
+        if key not in self._mel:
+            import librosa
+            self._mel[key] = librosa.feature.melspectrogram(
+                S=np.asarray(self.power), sr=self.sr, n_fft=self.n_fft, n_mels=n_mels, fmax=fmax)
+        return self._mel[key]
+
+    def mel_db(self, n_mels=128, fmax=None):
+        """mel_power in dB relative to each signal's maximum (see to_db)."""
+        key = ("db", n_mels, fmax)
+        if key not in self._mel:
+            self._mel[key] = to_db(self.mel_power(n_mels, fmax))
+        return self._mel[key]
+
+    def istft(self, S, length=None):
+        """Inverse transform of a spectrogram with this analysis' frame layout."""
+        length = self.y.shape[-1] if length is None else length
+        if _is_tensor(S):
+            import torch
+
+            lead = S.shape[:-2]
+            y = torch.istft(S.reshape(-1, *S.shape[-2:]), self.n_fft, self.hop_length,
+                            window=self.window, length=length)
+            return y.reshape(*lead, length)
+        import librosa
+
+        return librosa.istft(S, n_fft=self.n_fft, hop_length=self.hop_length, window=self.window,
+                             length=length)
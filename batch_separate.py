@@ -0,0 +1,179 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import model_registry
+import separation as sep
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+
+# Per-process state of a batch worker
+_models = None
+_model_id = None
+
+
+def find_tracks(patterns):
+    """Expands directories (recursively), globs and plain paths into a sorted list of audio files."""
+    tracks = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                tracks.update(os.path.join(root, f) for f in files if f.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            tracks.update(p for p in glob.glob(pattern, recursive=True)
+                          if os.path.isfile(p) and p.lower().endswith(AUDIO_EXTENSIONS))
+    return sorted(os.path.abspath(t) for t in tracks)
+
+
+def read_manifest(path):
+    """Returns the latest manifest record per track."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            records[record["track"]] = record
+    return records
+
+
+def is_done(record):
+    return (record is not None and record.get("status") == "done"
+            and all(os.path.exists(p) for p in record.get("outputs", {}).values()))
+
+
+def append_manifest(path, record):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def track_out_dirs(out_dir, tracks):
+    """
+    Output directory of every track: its path relative to the batch's common
+    input folder, without the extension (a/song.mp3 -> <out_dir>/a/song), so
+    same-named files in different folders do not overwrite each other.
+    Files differing only by extension keep it (song.mp3 -> song_mp3).
+    """
+    if not tracks:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(t)) for t in tracks])
+    names = {t: os.path.splitext(os.path.relpath(os.path.abspath(t), root))[0] for t in tracks}
+    counts = {}
+    for name in names.values():
+        counts[name] = counts.get(name, 0) + 1
+    return {t: os.path.join(out_dir, name if counts[name] == 1 else name + "_" + os.path.splitext(t)[1][1:])
+            for t, name in names.items()}
+
+
+def _init_worker(weights_dir, demucs_name, backend, n_threads):
+    global _models, _model_id
+    if n_threads:
+        # Must be set before torch spins up its thread pools
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(n_threads)
+        import torch
+        torch.set_num_threads(n_threads)
+        torch.set_num_interop_threads(1)
+
+    import result_cache
+
+    # The models load in the background while the weight files are hashed
+    model_registry.warm_up(weights_dir, demucs_name, backend)
+    _model_id = result_cache.model_id(weights_dir, demucs_name, backend)
+    _models = model_registry.get_models(weights_dir, demucs_name, backend)
+
+
+def _separate_one(track, out_dir, chunk_seconds, use_cache, memory_budget_mb):
+    started = time.time()
+    cpu_started = time.process_time()
+    mixer, d_model, m_model = _models
+    done = None
+    for event in sep.stream_separation(track, mixer, d_model, m_model, out_dir=out_dir,
+                                       chunk_seconds=chunk_seconds, memory_budget_mb=memory_budget_mb,
+                                       model_id=_model_id if use_cache else None):
+        done = event
+    return {"outputs": done["outputs"], "cached": done.get("cached", False),
+            "seconds": round(time.time() - started, 3),
+            "cpu_seconds": round(time.process_time() - cpu_started, 3)}
+
+
+def run_batch(tracks, out_dir, manifest_path, workers=1, threads=None, weights_dir=sep.WEIGHTS_DIR,
+              demucs_name="htdemucs", backend="torch", chunk_seconds=sep.CHUNK_SECONDS, use_cache=True,
+              memory_budget_mb=None):
+    """
+    Separates `tracks` on a pool of `workers` processes, each loading the models
+    once and limited to `threads` intra-op threads. Every state change is
+    appended to the JSON-lines manifest; tracks already recorded as done are
+    skipped, so an interrupted run resumes where it stopped.
+    `memory_budget_mb` (per worker) sizes the chunks instead of `chunk_seconds`.
+    Returns (n_done, n_failed, n_skipped).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    previous = read_manifest(manifest_path)
+    todo = [t for t in tracks if not is_done(previous.get(t))]
+    n_skipped = len(tracks) - len(todo)
+    print(f"{len(tracks)} tracks | {n_skipped} already done | {len(todo)} to process")
+    if not todo:
+        return 0, 0, n_skipped
+
+    n_done = n_failed = 0
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(weights_dir, demucs_name, backend, threads)) as pool:
+        futures = {}
+        out_dirs = track_out_dirs(out_dir, tracks)
+        for track in todo:
+            append_manifest(manifest_path, {"track": track, "status": "queued", "time": time.time()})
+            futures[pool.submit(_separate_one, track, out_dirs[track],
+                                chunk_seconds, use_cache, memory_budget_mb)] = track
+
+        for future in as_completed(futures):
+            track = futures[future]
+            record = {"track": track, "time": time.time()}
+            try:
+                record.update(future.result(), status="done")
+                n_done += 1
+                print(f"[{n_done + n_failed}/{len(todo)}] done  {track} ({record['seconds']:.1f}s"
+                      f"{', cached' if record['cached'] else ''})")
+            except Exception as e:
+                record.update(status="failed", error=f"{type(e).__name__}: {e}",
+                              traceback=traceback.format_exc())
+                n_failed += 1
+                print(f"[{n_done + n_failed}/{len(todo)}] FAILED {track}: {e}")
+            append_manifest(manifest_path, record)
+    return n_done, n_failed, n_skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch stem separation with a resumable manifest.")
+    parser.add_argument("inputs", nargs="+", help="Audio files, directories or glob patterns")
+    parser.add_argument("--out-dir", default="separated")
+    parser.add_argument("--manifest", default=None, help="JSON-lines manifest (default: <out-dir>/manifest.jsonl)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument("--threads", type=int, default=None, help="Intra-op threads per worker")
+    parser.add_argument("--weights", default=sep.WEIGHTS_DIR)
+    parser.add_argument("--demucs", default="htdemucs")
+    parser.add_argument("--backend", choices=("torch", "onnx", "onnx-int8"), default="torch")
+    parser.add_argument("--chunk-seconds", type=float, default=sep.CHUNK_SECONDS)
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="MB",
+                        help="Per-worker memory budget; picks the chunk size instead of --chunk-seconds")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the separation result cache")
+    args = parser.parse_args()
+
+    tracks = find_tracks(args.inputs)
+    manifest = args.manifest or os.path.join(args.out_dir, "manifest.jsonl")
+    done, failed, skipped = run_batch(tracks, args.out_dir, manifest, args.workers, args.threads,
+                                      args.weights, args.demucs, args.backend, args.chunk_seconds,
+                                      not args.no_cache, args.memory_budget)
+    print(f"Finished: {done} done, {failed} failed, {skipped} skipped. Manifest: {manifest}")
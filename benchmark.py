@@ -0,0 +1,337 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from synthetic import SYNTHETIC_SR, synthetic_signal
+
+MIXTURE = "temp_input.mp3"
+STEM_FILES = {stem: f"{stem}_1765609752.mp3" for stem in ['Vocals', 'Drums', 'Bass', 'Other']}
+
+RESULTS_PATH = "bench_results.json"
+BASELINE_PATH = "bench_baseline.json"
+
+
+# ==========================================
+# INPUTS
+# ==========================================
+def write_synthetic(seconds, out_dir):
+    import soundfile as sf
+
+    path = os.path.join(out_dir, f"synthetic_{seconds:g}s.wav")
+    if not os.path.exists(path):
+        sf.write(path, synthetic_signal(seconds), SYNTHETIC_SR)
+    return path
+
+
+# ==========================================
+# CASES
+# ==========================================
+# Each case takes the input paths and returns (callable to time, audio seconds
+# processed per call or None, callable run before every repetition or None).
+CASES = {}
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def _fresh_feature_cache(inputs):
+    """Hook pointing the feature cache at a new, empty folder of the run's work directory."""
+    def reset():
+        import feature_cache
+        feature_cache.CACHE_DIR = tempfile.mkdtemp(prefix="features-", dir=inputs["work_dir"])
+    return reset
+
+
+def _duration(path):
+    import soundfile as sf
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Benchmark input not found: {path}")
+    return sf.info(path).duration
+
+
+@case("decode/librosa")
+def _decode_librosa(inputs):
+    import librosa
+    path = inputs["mixture"]
+    return (lambda: librosa.load(path)), _duration(path), None
+
+
+@case("decode/stream_blocks")
+def _decode_stream(inputs):
+    import separation as sep
+    path = inputs["mixture"]
+    return (lambda: sum(b.shape[1] for b in sep.decode_blocks(path))), _duration(path), None
+
+
+@case("stft/synthetic")
+def _stft(inputs):
+    import librosa
+    y = synthetic_signal(inputs["synthetic_seconds"])[:, 0]
+    return (lambda: librosa.stft(y, n_fft=2048)), inputs["synthetic_seconds"], None
+
+
+@case("welch_psd/synthetic")
+def _welch(inputs):
+    import spectral
+    path = inputs["synthetic"]
+    return (lambda: spectral.welch_psd(path)), _duration(path), None
+
+
+@case("plot_spectrogram/cold")
+def _spec_full_cold(inputs):
+    import viz_utils as viz
+    path = inputs["stems"]["Vocals"]
+    return (lambda: viz.plot_spectrogram(path)), _duration(path), _fresh_feature_cache(inputs)
+
+
+@case("plot_spectrogram/warm")
+def _spec_full_warm(inputs):
+    import viz_utils as viz
+    path = inputs["stems"]["Vocals"]
+    _fresh_feature_cache(inputs)()
+    viz.plot_spectrogram(path)
+    return (lambda: viz.plot_spectrogram(path)), _duration(path), None
+
+
+@case("plot_spectrogram_view/cold")
+def _spec_cold(inputs):
+    import viz_utils as viz
+    path = inputs["stems"]["Vocals"]
+    return (lambda: viz.plot_spectrogram_view(path)), _duration(path), _fresh_feature_cache(inputs)
+
+
+@case("plot_spectrogram_view/warm")
+def _spec_warm(inputs):
+    import viz_utils as viz
+    path = inputs["stems"]["Vocals"]
+    _fresh_feature_cache(inputs)()
+    viz.plot_spectrogram_view(path)
+    return (lambda: viz.plot_spectrogram_view(path)), _duration(path), None
+
+
+@case("plot_before_after_psd/cold")
+def _psd_cold(inputs):
+    import viz_utils as viz
+    mix, stem = inputs["mixture"], inputs["stems"]["Vocals"]
+    return (lambda: viz.plot_before_after_psd(mix, stem, "Vocals")), _duration(mix), _fresh_feature_cache(inputs)
+
+
+@case("plot_before_after_psd/warm")
+def _psd_warm(inputs):
+    import viz_utils as viz
+    mix, stem = inputs["mixture"], inputs["stems"]["Vocals"]
+    _fresh_feature_cache(inputs)()
+    viz.plot_before_after_psd(mix, stem, "Vocals")
+    return (lambda: viz.plot_before_after_psd(mix, stem, "Vocals")), _duration(mix), None
+
+
+def _one_chunk(path):
+    import separation as sep
+    chunk = next(sep.read_chunks(path, int(sep.CHUNK_SECONDS * sep.MODEL_SR), 0))[1]
+    return sep.pad_chunk(chunk), chunk.shape[1] / sep.MODEL_SR
+
+
+@case("separation/demucs")
+def _sep_demucs(inputs):
+    import separation as sep
+    chunk, seconds = _one_chunk(inputs["mixture"])
+    d_model = sep.load_demucs()
+    return (lambda: sep.run_demucs(d_model, chunk)), seconds, None
+
+
+@case("separation/mdx")
+def _sep_mdx(inputs):
+    import separation as sep
+    chunk, seconds = _one_chunk(inputs["mixture"])
+    m_model = sep.load_mdx(inputs["weights"], inputs["backend"])
+    return (lambda: sep.run_mdx(m_model, chunk)), seconds, None
+
+
+@case("separation/stem_mixer")
+def _sep_mixer(inputs):
+    import separation as sep
+    chunk, seconds = _one_chunk(inputs["mixture"])
+    mixer, d_model, m_model = sep.load_models(inputs["weights"], backend=inputs["backend"])
+    d_out, m_out = sep.run_demucs(d_model, chunk), sep.run_mdx(m_model, chunk)
+    return (lambda: sep.mix_chunk(mixer, d_out, m_out, chunk.shape[1])), seconds, None
+
+
+@case("separation/end_to_end")
+def _sep_e2e(inputs):
+    import separation as sep
+    path = inputs["mixture"]
+    mixer, d_model, m_model = sep.load_models(inputs["weights"], backend=inputs["backend"])
+    out_dir = tempfile.mkdtemp(prefix="sep-", dir=inputs["work_dir"])
+    return (lambda: sep.separate_audio(path, mixer, d_model, m_model, out_dir=out_dir)), _duration(path), None
+
+
+# ==========================================
+# RUNNER
+# ==========================================
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2 ** 20
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _run_case(name, inputs, repeats, warmup):
+    """Runs one case in the current (fresh) process."""
+    fn, audio_seconds, before_each = CASES[name](inputs)
+    for _ in range(warmup):
+        if before_each:
+            before_each()
+        fn()
+    times = []
+    for _ in range(repeats):
+        if before_each:
+            before_each()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    times = np.array(times)
+    result = {
+        "runs": repeats,
+        "mean": float(times.mean()),
+        "min": float(times.min()),
+        "p50": float(np.percentile(times, 50)),
+        "p90": float(np.percentile(times, 90)),
+        "p99": float(np.percentile(times, 99)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if audio_seconds:
+        result["audio_seconds"] = audio_seconds
+        # Real-time factor: processing time per second of audio (< 1 is faster than real time)
+        result["rtf_p50"] = result["p50"] / audio_seconds
+    return result
+
+
+# Missing inputs, weights or optional packages (demucs, onnxruntime) skip a case;
+# anything else raised while setting up or timing it is a failure
+SKIP_ERRORS = (FileNotFoundError, ImportError)
+
+
+def run_case_isolated(name, inputs, repeats, warmup):
+    """Each case gets its own spawned process so peak RSS and caches are per case."""
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+        try:
+            return pool.submit(_run_case, name, inputs, repeats, warmup).result()
+        except SKIP_ERRORS as e:
+            return {"skipped": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            return {"failed": f"{type(e).__name__}: {e}"}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "commit": commit, "time": time.time()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the cases whose p50 regressed by more than `tolerance` (fraction)
+    vs the baseline. A case with a baseline p50 but none now (it failed or was
+    skipped) is a regression with `after` and `change` None.
+    """
+    regressions = []
+    for name, res in results["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or "p50" not in base:
+            continue
+        if "p50" not in res:
+            regressions.append((name, base["p50"], None, None))
+            continue
+        change = res["p50"] / base["p50"] - 1
+        res["vs_baseline"] = change
+        if change > tolerance:
+            regressions.append((name, base["p50"], res["p50"], change))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SpecTacles visualization and separation benchmarks.")
+    parser.add_argument("--cases", nargs="*", default=None, help="Case names or prefixes (default: all)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--synthetic-seconds", type=float, default=60.0)
+    parser.add_argument("--weights", default=os.environ.get("SPECTACLES_WEIGHTS_DIR", "weights"))
+    parser.add_argument("--backend", choices=("torch", "onnx", "onnx-int8"), default="torch")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown before flagging")
+    args = parser.parse_args()
+
+    # Inputs, feature caches and separated stems of the run; removed when it ends
+    with tempfile.TemporaryDirectory(prefix="bench-") as work_dir:
+        inputs = {
+            "mixture": os.path.abspath(MIXTURE),
+            "stems": {stem: os.path.abspath(p) for stem, p in STEM_FILES.items()},
+            "synthetic": write_synthetic(args.synthetic_seconds, work_dir),
+            "synthetic_seconds": args.synthetic_seconds,
+            "weights": os.path.abspath(args.weights),
+            "backend": args.backend,
+            "work_dir": work_dir,
+        }
+        names = [n for n in CASES if not args.cases or any(n.startswith(c) for c in args.cases)]
+
+        results = {"environment": environment(), "repeats": args.repeats, "cases": {}}
+        for name in names:
+            res = run_case_isolated(name, inputs, args.repeats, args.warmup)
+            results["cases"][name] = res
+            if "skipped" in res:
+                print(f"{name:<30} skipped ({res['skipped']})")
+            elif "failed" in res:
+                print(f"{name:<30} FAILED ({res['failed']})")
+            else:
+                rss = f"{res['peak_rss_mb']:.0f} MB" if res["peak_rss_mb"] else "n/a"
+                print(f"{name:<30} p50 {res['p50'] * 1000:9.1f} ms | p90 {res['p90'] * 1000:9.1f} ms | "
+                      f"RTF {res.get('rtf_p50', float('nan')):.4f} | peak RSS {rss}")
+
+    exit_code = 1 if any("failed" in res for res in results["cases"].values()) else 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, before, after, change in regressions:
+            if after is None:
+                res = results["cases"][name]
+                print(f"REGRESSION {name}: p50 {before * 1000:.1f} ms -> {res.get('failed') or res.get('skipped')}")
+            else:
+                print(f"REGRESSION {name}: p50 {before * 1000:.1f} ms -> {after * 1000:.1f} ms ({change:+.0%})")
+        if regressions:
+            exit_code = 1
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    sys.exit(exit_code)
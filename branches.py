@@ -0,0 +1,123 @@
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import separation as sep
+
+EXECUTION_MODES = ("serial", "thread", "process")
+
+# Model held by a process-mode worker (one branch per process)
+_worker_model = None
+
+
+def _set_threads(n_threads):
+    if n_threads:
+        import torch
+        torch.set_num_threads(n_threads)
+
+
+def _init_process_worker(branch, weights_dir, demucs_name, backend, n_threads):
+    global _worker_model
+    _set_threads(n_threads)
+    if branch == "demucs":
+        _worker_model = sep.load_demucs(demucs_name)
+    else:
+        _worker_model = sep.load_mdx(weights_dir, backend)
+
+
+def _run_process_worker(branch, chunk):
+    run = sep.run_demucs if branch == "demucs" else sep.run_mdx
+    return run(_worker_model, chunk).numpy()
+
+
+class _Deferred:
+    """Future-like wrapper that runs its call when the result is requested."""
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def result(self):
+        return self.fn(*self.args)
+
+
+class BranchRunner:
+    """
+    Runs the Demucs and MDX base-model branches of a chunk.
+
+    - serial: one after the other in the calling thread
+    - thread: concurrently on two single-thread pools sharing the loaded models
+    - process: concurrently on two single-worker process pools; each worker
+      loads its own branch from `weights_dir` with `backend`, so d_model/m_model
+      may be None
+
+    `branch_threads` = (demucs, mdx) torch intra-op thread counts; None keeps
+    torch's default. In thread mode they are applied per worker thread, which
+    OpenMP builds of torch honour; process mode isolates them fully.
+    """
+
+    def __init__(self, d_model, m_model, mode="serial", branch_threads=(None, None),
+                 weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch"):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {mode} (expected one of {EXECUTION_MODES})")
+        self.mode = mode
+        self.d_model = d_model
+        self.m_model = m_model
+        self.pools = None
+
+        d_threads, m_threads = branch_threads
+        if mode == "thread":
+            self.pools = (
+                ThreadPoolExecutor(1, thread_name_prefix="demucs", initializer=_set_threads, initargs=(d_threads,)),
+                ThreadPoolExecutor(1, thread_name_prefix="mdx", initializer=_set_threads, initargs=(m_threads,)),
+            )
+        elif mode == "process":
+            # spawn: forking a process that already runs torch threads can deadlock
+            ctx = multiprocessing.get_context("spawn")
+            self.pools = (
+                ProcessPoolExecutor(1, mp_context=ctx, initializer=_init_process_worker,
+                                    initargs=("demucs", weights_dir, demucs_name, backend, d_threads)),
+                ProcessPoolExecutor(1, mp_context=ctx, initializer=_init_process_worker,
+                                    initargs=("mdx", weights_dir, demucs_name, backend, m_threads)),
+            )
+
+    def submit(self, chunk):
+        """Starts both branches on a padded (2, T) chunk; returns a handle for result()."""
+        if self.mode == "serial":
+            return (_Deferred(sep.run_demucs, self.d_model, chunk),
+                    _Deferred(sep.run_mdx, self.m_model, chunk))
+        d_pool, m_pool = self.pools
+        if self.mode == "thread":
+            # Run in a copy of the caller's context so profiling stages reach its recorder
+            return (d_pool.submit(contextvars.copy_context().run, sep.run_demucs, self.d_model, chunk),
+                    m_pool.submit(contextvars.copy_context().run, sep.run_mdx, self.m_model, chunk))
+        return (d_pool.submit(_run_process_worker, "demucs", chunk),
+                m_pool.submit(_run_process_worker, "mdx", chunk))
+
+    def result(self, handle):
+        """Waits for a submitted chunk; returns (demucs_out, mdx_out)."""
+        d_fut, m_fut = handle
+        return d_fut.result(), m_fut.result()
+
+    def discard(self, handle):
+        """Drops a submitted chunk, waiting for branches already running so their memory is freed."""
+        if handle is None or self.mode == "serial":
+            return
+        for fut in handle:
+            if not fut.cancel():
+                try:
+                    fut.result()
+                except Exception:
+                    pass
+
+    def close(self):
+        if self.pools is not None:
+            for pool in self.pools:
+                pool.shutdown(wait=True, cancel_futures=True)
+            self.pools = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,20 +1,67 @@
 import streamlit as st
 import streamlit.components.v1 as components
-import base64
+import json
 import os
+import shutil
+import tempfile
+import feature_cache
+import stem_container
+import waveform_peaks
+
+# Served by Streamlit's static file route (server.enableStaticServing in
+# .streamlit/config.toml) at app/static/..., with HTTP range support
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+MEDIA_DIR = os.path.join(STATIC_DIR, "media")
+STATIC_URL = "app/static"
+# wavesurfer.js 7 ES module; version and source in static/vendor/wavesurfer.LICENSE
+WAVESURFER_URL = f"{STATIC_URL}/vendor/wavesurfer.esm.js"
+
+# Peaks handed to the player: about two per pixel of a wide layout
+PLAYER_PEAKS = 2400
+
+def publish_media(audio_path):
+    """
+    Exposes an audio file on the static route under its content hash (hard
+    link, or copy across filesystems) and returns its URL.
+    """
+    name = feature_cache.file_digest(audio_path)[:24] + os.path.splitext(audio_path)[1].lower()
+    target = os.path.join(MEDIA_DIR, name)
+    if not os.path.exists(target):
+        os.makedirs(MEDIA_DIR, exist_ok=True)
+        # A unique temp name: threads of one server may publish the same file at once
+        fd, tmp = tempfile.mkstemp(dir=MEDIA_DIR, prefix=name + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            try:
+                os.remove(tmp)
+                os.link(audio_path, tmp)
+            except OSError:
+                shutil.copyfile(audio_path, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return f"{STATIC_URL}/media/{name}"
 
 def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color="#6366f1", key=None):
     """
     Renders an interactive Waveform Player using Wavesurfer.js.
+    The waveform is drawn from cached peaks, so it appears before any audio
+    is loaded; the audio streams from the static route on demand.
     """
     if not os.path.exists(audio_path):
         st.error(f"Audio file not found: {audio_path}")
         return
+    if not st.get_option("server.enableStaticServing"):
+        # No static route to stream from: fall back to the native player
+        st.audio(audio_path)
+        return
 
-    # Read Audio and Encode to Base64
-    with open(audio_path, "rb") as f:
-        audio_bytes = f.read()
-        b64_audio = base64.b64encode(audio_bytes).decode()
+    audio_url = publish_media(audio_path)
+    peaks = waveform_peaks.peaks_for_width(audio_path, PLAYER_PEAKS)
+    duration = stem_container.info(audio_path)[1]
+    peaks_json = json.dumps([[round(float(p), 3) for p in peaks]])
     
     # Unique ID for the container
     # Using python hash of path + key to ensure uniqueness
@@ -24,7 +71,6 @@ def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color
     <!DOCTYPE html>
     <html>
     <head>
-        <script src="https://unpkg.com/wavesurfer.js@7/dist/wavesurfer.min.js"></script>
         <style>
             body {{
                 background-color: #18181b; /* Zinc 900 - Matches Card Background */
@@ -65,7 +111,7 @@ def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color
     </head>
     <body>
         <div id="controls">
-            <button id="playBtn" onclick="togglePlay()">
+            <button id="playBtn">
                 <svg xmlns="http://www.w3.org/2000/svg" width="32" height="32" viewBox="0 0 24 24" fill="currentColor">
                     <path d="M8 5v14l11-7z" name="play"/>
                     <path d="M6 19h4V5H6v14zm8-14v14h4V5h-4z" name="pause" style="display:none"/>
@@ -74,9 +120,16 @@ def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color
         </div>
         <div id="waveform"></div>
 
-        <script>
-            // Initialize Wavesurfer
+        <script type="module">
+            import WaveSurfer from './{WAVESURFER_URL}';
+
+            // Initialize Wavesurfer from precomputed peaks: no download or
+            // decode of the whole file before the waveform shows; the audio
+            // element then streams it with range requests as it plays
+            const media = document.createElement('audio');
+            media.preload = 'metadata';
             const wavesurfer = WaveSurfer.create({{
+                media: media,
                 container: '#waveform',
                 waveColor: '{wave_color}',
                 progressColor: '{progress_color}',
@@ -87,7 +140,9 @@ def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color
                 height: {height - 20}, // Adjust for padding
                 barGap: 2,
                 normalize: true,
-                url: 'data:audio/mp3;base64,{b64_audio}'
+                url: './{audio_url}',
+                peaks: {peaks_json},
+                duration: {duration}
             }});
 
             // Play/Pause Logic
@@ -95,9 +150,8 @@ def waveform_player(audio_path, height=100, wave_color="#a1a1aa", progress_color
             const playIcon = btn.querySelector('path[name="play"]');
             const pauseIcon = btn.querySelector('path[name="pause"]');
 
-            function togglePlay() {{
-                wavesurfer.playPause();
-            }}
+            // Module scripts are not global: bind the handler here
+            btn.addEventListener('click', () => wavesurfer.playPause());
 
             wavesurfer.on('play', () => {{
                 playIcon.style.display = 'none';
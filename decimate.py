@@ -0,0 +1,86 @@
+import numpy as np
+
+# Plotly charts rarely need more than ~2 points per horizontal pixel
+POINTS_PER_PIXEL = 2
+DEFAULT_CHART_WIDTH = 1200
+
+
+def target_points(chart_width=DEFAULT_CHART_WIDTH, points_per_pixel=POINTS_PER_PIXEL):
+    return max(int(chart_width * points_per_pixel), 3)
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last points and, for every bucket in between, the point
+    forming the largest triangle with the previous pick and the next bucket's mean.
+    Returns the indices of the kept points.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Mean of the next bucket (or the last point for the final bucket)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+
+        bx = x[lo:hi]
+        by = y[lo:hi]
+        area = np.abs((x[prev] - avg_x) * (by - y[prev]) - (x[prev] - bx) * (avg_y - y[prev]))
+        prev = lo + int(np.argmax(area))
+        keep[i + 1] = prev
+    return keep
+
+
+def minmax(y, n_out):
+    """
+    Min/max envelope downsampling: keeps the extremes of each of n_out/2 buckets
+    in their original order, so peaks are never lost.
+    Returns the indices of the kept points.
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, n_buckets + 1).astype(int)
+    width = int(np.max(np.diff(edges)))
+    # Pad every bucket to a common width so the search is one vectorized pass
+    pos = edges[:-1, None] + np.arange(width)[None, :]
+    valid = pos < edges[1:, None]
+    pos = np.minimum(pos, n - 1)
+    vals = y[pos]
+    lo = np.take_along_axis(pos, np.argmin(np.where(valid, vals, np.inf), axis=1)[:, None], axis=1)
+    hi = np.take_along_axis(pos, np.argmax(np.where(valid, vals, -np.inf), axis=1)[:, None], axis=1)
+    return np.unique(np.concatenate([lo[:, 0], hi[:, 0]]))
+
+
+def decimate_series(x, y, chart_width=DEFAULT_CHART_WIDTH, method="lttb", log_x=False):
+    """
+    Reduces an (x, y) series to what a chart `chart_width` pixels wide can show.
+    `log_x` makes LTTB pick points in log-x space, matching a log-scaled axis.
+    Returns the decimated (x, y) arrays.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n_out = target_points(chart_width)
+    if len(x) <= n_out:
+        return x, y
+
+    if method == "minmax":
+        idx = minmax(y, n_out)
+    elif method == "lttb":
+        xs = np.log10(np.maximum(x, 1e-12)) if log_x else x
+        idx = lttb(xs.astype(np.float64), y.astype(np.float64), n_out)
+    else:
+        raise ValueError(f"Unknown decimation method: {method}")
+    return x[idx], y[idx]
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import feature_cache
+import stem_container
+
+STEMS = ['Vocals', 'Drums', 'Bass', 'Other']
+RESULTS_PATH = "sdr_results.json"
+CACHE_DIR = os.environ.get("SPECTACLES_EVAL_CACHE_DIR", os.path.join(".cache", "evaluation"))
+
+# BSS Eval v4 defaults: 1 s windows, 1 s hop, median over frames then tracks
+WINDOW_SECONDS = 1.0
+HOP_SECONDS = 1.0
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3")
+
+
+# ==========================================
+# METRICS
+# ==========================================
+def frame_signals(x, win, hop):
+    """(n_samples, n_channels) -> (n_frames, win * n_channels) view of full frames."""
+    if len(x) < win:
+        # Shorter than one window: score the whole signal as a single frame
+        return x.reshape(1, -1)
+    frames = np.lib.stride_tricks.sliding_window_view(x, win, axis=0)[::hop]
+    return frames.reshape(len(frames), -1)
+
+
+def framewise_sdr(reference, estimate, win, hop, eps=1e-10):
+    """
+    Framewise SDR and SI-SDR (dB) of every frame at once.
+    Frames where the reference is silent are NaN, as in BSS Eval.
+    Returns (sdr, si_sdr) arrays of shape (n_frames,).
+    """
+    ref = frame_signals(reference.astype(np.float64), win, hop)
+    est = frame_signals(estimate.astype(np.float64), win, hop)
+    ref_energy = np.einsum("ij,ij->i", ref, ref)
+    silent = ref_energy < eps
+
+    err = ref - est
+    sdr = 10 * np.log10((ref_energy + eps) / (np.einsum("ij,ij->i", err, err) + eps))
+
+    alpha = np.einsum("ij,ij->i", est, ref) / (ref_energy + eps)
+    target = alpha[:, None] * ref
+    noise = est - target
+    si_sdr = 10 * np.log10((np.einsum("ij,ij->i", target, target) + eps) /
+                           (np.einsum("ij,ij->i", noise, noise) + eps))
+    sdr[silent] = np.nan
+    si_sdr[silent] = np.nan
+    return sdr, si_sdr
+
+
+# ==========================================
+# DATASET LAYOUT
+# ==========================================
+def _find_file(folder, stem):
+    if folder.endswith(".stems"):
+        tracks = stem_container.open_container(folder).tracks
+        for name in (stem, stem.lower()):
+            if name in tracks:
+                return stem_container.make_ref(folder, name)
+        return None
+    for ext in AUDIO_EXTENSIONS:
+        for name in (stem.lower(), stem):
+            path = os.path.join(folder, name + ext)
+            if os.path.exists(path):
+                return path
+    # This repo's own separation output: <Stem>_<timestamp>.mp3, newest run first
+    runs = []
+    for name in os.listdir(folder):
+        base, ext = os.path.splitext(name)
+        prefix, _, timestamp = base.rpartition("_")
+        if ext.lower() in AUDIO_EXTENSIONS and prefix.lower() == stem.lower() and timestamp.isdigit():
+            runs.append((int(timestamp), name))
+    return os.path.join(folder, max(runs)[1]) if runs else None
+
+
+def list_tracks(root, split="test"):
+    """Track folders (or .stems containers) of a MUSDB18-style `<root>/<split>/<track>/{vocals,drums,bass,other}.wav` tree."""
+    split_dir = os.path.join(root, split)
+    return sorted({name[:-len(".stems")] if name.endswith(".stems") else name
+                   for name in os.listdir(split_dir)
+                   if name.endswith(".stems") or os.path.isdir(os.path.join(split_dir, name))})
+
+
+def track_dir(root, split, track):
+    """A track's folder, or its packed `<track>.stems` container if there is one."""
+    container = os.path.join(root, split, track + ".stems")
+    return container if os.path.exists(container) else os.path.join(root, split, track)
+
+
+# ==========================================
+# PER-TRACK EVALUATION (CACHED)
+# ==========================================
+def _cache_key(ref_paths, est_paths, params):
+    payload = json.dumps({
+        "refs": {s: feature_cache.file_digest(p) for s, p in ref_paths.items()},
+        "ests": {s: feature_cache.file_digest(p) for s, p in est_paths.items()},
+        "params": params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def evaluate_track(ref_dir, est_dir, window_seconds=WINDOW_SECONDS, hop_seconds=HOP_SECONDS):
+    """
+    Evaluates one track's estimates against its references. Either side may
+    be a folder of stem files or a packed stem container.
+    Results are cached on the content hashes of all files involved.
+    Returns {stem: {"sdr": median dB, "si_sdr": median dB, "frames": n}}.
+    """
+    ref_paths, est_paths = {}, {}
+    for stem in STEMS:
+        ref, est = _find_file(ref_dir, stem), _find_file(est_dir, stem)
+        if ref and est:
+            ref_paths[stem], est_paths[stem] = ref, est
+    params = {"window": window_seconds, "hop": hop_seconds}
+    key = _cache_key(ref_paths, est_paths, params)
+    cache_path = os.path.join(CACHE_DIR, key + ".json")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    result = {}
+    for stem in ref_paths:
+        reference, sr = stem_container.read(ref_paths[stem])
+        estimate, est_sr = stem_container.read(est_paths[stem])
+        if est_sr != sr:
+            raise ValueError(f"{est_paths[stem]} is at {est_sr} Hz but its reference {ref_paths[stem]} "
+                             f"is at {sr} Hz")
+        n = min(len(reference), len(estimate))
+        n_ch = min(reference.shape[1], estimate.shape[1])
+        sdr, si_sdr = framewise_sdr(reference[:n, :n_ch], estimate[:n, :n_ch],
+                                    int(window_seconds * sr), int(hop_seconds * sr))
+        result[stem] = {"sdr": _nanmedian(sdr), "si_sdr": _nanmedian(si_sdr), "frames": int(len(sdr))}
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = cache_path + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    os.replace(tmp, cache_path)
+    return result
+
+
+def _nanmedian(values):
+    values = values[~np.isnan(values)]
+    return float(np.median(values)) if len(values) else None
+
+
+# ==========================================
+# DATASET EVALUATION
+# ==========================================
+def evaluate(root, estimates, split="test", workers=None, window_seconds=WINDOW_SECONDS,
+             hop_seconds=HOP_SECONDS):
+    """
+    Evaluates every model in `estimates` ({model name: estimates root with the
+    same <split>/<track>/ layout}) over the dataset, one track per pool task.
+    Returns the results document written by save_results.
+    """
+    tracks = list_tracks(root, split)
+    jobs = [(model, track) for model in estimates for track in tracks
+            if os.path.exists(track_dir(estimates[model], split, track))]
+    per_track = {model: {} for model in estimates}
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(evaluate_track, track_dir(root, split, track),
+                               track_dir(estimates[model], split, track),
+                               window_seconds, hop_seconds): (model, track)
+                   for model, track in jobs}
+        for future, (model, track) in futures.items():
+            per_track[model][track] = future.result()
+
+    summary = {}
+    for model, tracks_res in per_track.items():
+        summary[model] = {}
+        for stem in STEMS:
+            for metric in ("sdr", "si_sdr"):
+                vals = [r[stem][metric] for r in tracks_res.values()
+                        if stem in r and r[stem][metric] is not None]
+                summary[model].setdefault(stem, {})[metric] = float(np.median(vals)) if vals else None
+    return {
+        "source": f"evaluation.py on {os.path.abspath(root)} ({split})",
+        "created": time.time(),
+        "params": {"window_seconds": window_seconds, "hop_seconds": hop_seconds,
+                   "aggregate": "median over frames, then median over tracks"},
+        "models": summary,
+        "tracks": per_track,
+    }
+
+
+def save_results(results, path=RESULTS_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def load_results(path=RESULTS_PATH):
+    """Reads a results document; None if there is none yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def results_frame(results, metric="sdr"):
+    """Long-format rows (Stem, Model, value) for the dashboard chart."""
+    rows = []
+    for model, stems in results["models"].items():
+        for stem in STEMS:
+            value = stems.get(stem, {}).get(metric)
+            if value is not None:
+                rows.append({"Stem": stem, "Model": model, "SDR (dB)": value})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Framewise SDR/SI-SDR evaluation over a MUSDB18-style tree.")
+    parser.add_argument("root", help="Dataset root containing <split>/<track>/{vocals,drums,bass,other}.wav")
+    parser.add_argument("--estimates", nargs="+", required=True, metavar="NAME=DIR",
+                        help="Model name and its estimates root, e.g. SpecTacles=out/spectacles")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    estimates = dict(item.split("=", 1) for item in args.estimates)
+    results = evaluate(args.root, estimates, args.split, args.workers)
+    save_results(results, args.output)
+    for model, stems in results["models"].items():
+        line = " | ".join(f"{s}: {v['sdr']:.2f} dB" if v["sdr"] is not None else f"{s}: n/a"
+                          for s, v in stems.items())
+        print(f"{model:<12} {line}")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,279 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    print("MISSING_LIB")
+    sys.exit(1)
+
+# Pages per task: small enough to balance the pool, large enough to amortise opening the PDF
+PAGES_PER_TASK = 8
+STATE_NAME = ".extract_state.json"
+IMAGES_DIR = "images"
+
+# The document a worker has open: its path, file, reader and the images seen
+# so far. Only one is kept, so a worker's memory does not grow with the batch.
+# The reader parses pages lazily from the open file; an image object shared by
+# many pages (a logo) maps to its stored name and is decoded once.
+_open = {"path": None, "file": None, "reader": None, "images": {}}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_pdfs(patterns):
+    """Expands directories (recursively), globs and plain paths into a sorted list of PDFs."""
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                found.update(os.path.join(root, f) for f in files if f.lower().endswith(".pdf"))
+        else:
+            found.update(p for p in glob.glob(pattern) if p.lower().endswith(".pdf"))
+    return sorted(found)
+
+
+# ==========================================
+# WORKER
+# ==========================================
+def _reader(pdf_path):
+    """Reader of `pdf_path`, closing the previously open document if it is another one."""
+    if _open["path"] != pdf_path:
+        if _open["file"] is not None:
+            _open["file"].close()
+        _open.update(path=None, file=None, reader=None, images={})
+        f = open(pdf_path, "rb")
+        # A file object, not a path: pypdf would read the whole document into memory
+        _open.update(path=pdf_path, file=f, reader=PdfReader(f))
+    return _open["reader"]
+
+
+def _page_count(pdf_path):
+    """Pages of a PDF, read through a file object like _reader() so only the page tree is loaded."""
+    with open(pdf_path, "rb") as f:
+        return len(PdfReader(f).pages)
+
+
+def _image_object(page, key):
+    """Object number of a page's image XObject, or None where it has none (inline or nested images)."""
+    try:
+        ref = page["/Resources"]["/XObject"].raw_get(key)
+        return ref.idnum, ref.generation
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+
+def _save_image(images_dir, data, ext):
+    """Stores an image under its content hash; a repeat (in any page or document) is not written again."""
+    digest = hashlib.sha256(data).hexdigest()
+    name = digest[:24] + ext
+    path = os.path.join(images_dir, name)
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return name
+
+
+def extract_range(pdf_path, start, end, text_part, images_dir):
+    """
+    Extracts pages [start, end) of a PDF: text is written page by page to
+    `text_part`, images to `images_dir` (deduplicated by content hash).
+    Returns {page number: [image file names]} for the pages with images.
+    """
+    reader = _reader(pdf_path)
+    seen = _open["images"]
+    pages = {}
+    with open(text_part, "w", encoding="utf-8") as out:
+        for number in range(start, end):
+            page = reader.pages[number]
+            out.write((page.extract_text() or "") + "\n")
+            if images_dir is None:
+                continue
+            names = []
+            for key in page.images.keys():
+                obj = _image_object(page, key)
+                name = seen.get(obj) if obj is not None else None
+                if name is None:
+                    image = page.images[key]
+                    name = _save_image(images_dir, image.data, os.path.splitext(image.name)[1].lower())
+                    if obj is not None:
+                        seen[obj] = name
+                if name not in names:
+                    names.append(name)
+            if names:
+                pages[number + 1] = names
+    return pages
+
+
+# ==========================================
+# DOCUMENTS
+# ==========================================
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    tmp = path + ".part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _text_paths(out_dir, pdfs):
+    """
+    <out_dir>/<path relative to the inputs' common folder>.txt for every PDF,
+    so same-named documents in different folders get their own text file.
+    """
+    if not pdfs:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in pdfs])
+    return {p: os.path.join(out_dir, os.path.splitext(os.path.relpath(os.path.abspath(p), root))[0] + ".txt")
+            for p in pdfs}
+
+
+def _assemble(text_path, parts):
+    """Concatenates the per-range text files in page order, streamed, and removes them."""
+    tmp = text_path + ".part"
+    with open(tmp, "w", encoding="utf-8") as out:
+        for part in parts:
+            with open(part, encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+            os.remove(part)
+    os.replace(tmp, text_path)
+
+
+def extract_documents(pdfs, out_dir=".", workers=None, images=True, pages_per_task=PAGES_PER_TASK,
+                      force=False, text_paths=None):
+    """
+    Extracts the text and images of `pdfs` on a pool of `workers` processes.
+    Every document is split into ranges of `pages_per_task` pages, and all
+    ranges of all documents share the pool, so a batch scales with the cores.
+    Text goes to <out_dir>/<path relative to the inputs' common folder>.txt
+    (or `text_paths[pdf]`), written page by page; images to <out_dir>/images/, one file per distinct image, with
+    images/index.json listing the pages each appears on.
+    A document whose content hash matches the stored state is skipped
+    unless `force`. Returns {pdf: "extracted" | "unchanged" | "failed: ..."}.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    images_dir = os.path.join(out_dir, IMAGES_DIR) if images else None
+    if images_dir:
+        os.makedirs(images_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, STATE_NAME)
+    state = load_state(state_path)
+    text_paths = dict(_text_paths(out_dir, pdfs), **{p: t for p, t in (text_paths or {}).items() if t})
+
+    results, todo = {}, {}
+    for pdf in pdfs:
+        key = os.path.abspath(pdf)
+        digest = file_sha256(pdf)
+        text_path = text_paths[pdf]
+        os.makedirs(os.path.dirname(text_path) or ".", exist_ok=True)
+        previous = state.get(key)
+        if (not force and previous and previous["sha256"] == digest and previous["images"] >= images
+                and os.path.exists(previous["text"])):
+            results[pdf] = "unchanged"
+            continue
+        try:
+            n_pages = _page_count(pdf)
+        except Exception as e:
+            results[pdf] = f"failed: {type(e).__name__}: {e}"
+            continue
+        ranges = [(s, min(s + pages_per_task, n_pages)) for s in range(0, n_pages, pages_per_task)]
+        todo[pdf] = {"key": key, "sha256": digest, "text": text_path, "ranges": ranges, "n_pages": n_pages,
+                     "parts": [f"{text_path}.{s:06d}.part" for s, _ in ranges], "pages": {}, "pending": len(ranges)}
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {}
+        for pdf, doc in todo.items():
+            for (start, end), part in zip(doc["ranges"], doc["parts"]):
+                futures[pool.submit(extract_range, pdf, start, end, part, images_dir)] = pdf
+        for future in as_completed(futures):
+            pdf = futures[future]
+            doc = todo[pdf]
+            if pdf in results:
+                continue
+            try:
+                doc["pages"].update(future.result())
+            except Exception as e:
+                results[pdf] = f"failed: {type(e).__name__}: {e}"
+                continue
+            doc["pending"] -= 1
+            if not doc["pending"]:
+                _finish(pdf, doc, images, state, state_path, results)
+        for pdf, doc in todo.items():
+            if not doc["ranges"]:
+                _finish(pdf, doc, images, state, state_path, results)
+
+    # Ranges of a failed document may have finished after the failure
+    for pdf, doc in todo.items():
+        if results[pdf] != "extracted":
+            for part in doc["parts"]:
+                if os.path.exists(part):
+                    os.remove(part)
+
+    if images_dir:
+        _write_image_index(images_dir, state)
+    return results
+
+
+def _finish(pdf, doc, images, state, state_path, results):
+    _assemble(doc["text"], doc["parts"])
+    state[doc["key"]] = {"sha256": doc["sha256"], "text": doc["text"], "images": images,
+                         "pages": doc["n_pages"], "image_pages": doc["pages"], "time": time.time()}
+    save_state(state_path, state)
+    results[pdf] = "extracted"
+
+
+def _write_image_index(images_dir, state):
+    """images/index.json: image file -> [{"pdf", "page"}] over every extracted document."""
+    index = {}
+    for key, doc in sorted(state.items()):
+        for page, names in doc.get("image_pages", {}).items():
+            for name in names:
+                index.setdefault(name, []).append({"pdf": key, "page": int(page)})
+    with open(os.path.join(images_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the text and images of PDF documents.")
+    parser.add_argument("inputs", nargs="*", default=["semi-final.pdf"], help="PDF files, directories or globs")
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--text-out", default=None, help="Text file of a single input (e.g. pdf_content.txt)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK)
+    parser.add_argument("--no-images", action="store_true", help="Extract text only")
+    parser.add_argument("--force", action="store_true", help="Re-extract unchanged documents")
+    args = parser.parse_args()
+
+    pdfs = find_pdfs(args.inputs)
+    if not pdfs:
+        print(f"No PDF found in: {' '.join(args.inputs)}")
+        sys.exit(1)
+    if args.text_out and len(pdfs) > 1:
+        parser.error("--text-out needs a single input document")
+    started = time.time()
+    results = extract_documents(pdfs, args.out_dir, args.workers, not args.no_images, args.pages_per_task,
+                                args.force, {pdfs[0]: args.text_out} if args.text_out else None)
+    for pdf, status in results.items():
+        print(f"{status:<10} {pdf}")
+    print(f"{len(pdfs)} documents in {time.time() - started:.1f}s")
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import stem_container
+
+# Cache location and size budget can be overridden from the environment
+CACHE_DIR = os.environ.get("SPECTACLES_CACHE_DIR", os.path.join(".cache", "features"))
+MAX_CACHE_BYTES = int(os.environ.get("SPECTACLES_CACHE_MB", "512")) * 1024 * 1024
+
+# (abspath, size, mtime) -> sha256, so reruns don't re-hash unchanged files
+_digest_memo = {}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Returns the SHA-256 of a file's content.
+    The result is memoized on (path, size, mtime) so a rerun costs one stat().
+    A stem container track reference hashes the container plus the track name.
+    """
+    container, track = stem_container.parse_ref(path)
+    if track is not None:
+        return hashlib.sha256(f"{file_digest(container, chunk_size)}:{track}".encode()).hexdigest()
+    st_ = os.stat(path)
+    memo_key = (os.path.abspath(path), st_.st_size, st_.st_mtime_ns)
+    digest = _digest_memo.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        _digest_memo[memo_key] = digest
+    return digest
+
+
+def remember_digest(path, size, mtime_ns, digest):
+    """Seeds the digest memo with a hash recorded elsewhere (e.g. the track library) for this file version."""
+    _digest_memo[(os.path.abspath(path), size, mtime_ns)] = digest
+
+
+def cache_key(audio_path, kind, **params):
+    """
+    Builds a cache key from the file content hash, the feature kind and the
+    analysis parameters (sr, n_mels, fmax, n_fft, ...).
+    """
+    payload = json.dumps({"digest": file_digest(audio_path), "kind": kind, "params": params},
+                         sort_keys=True)
+    return f"{kind}-{hashlib.sha1(payload.encode()).hexdigest()}"
+
+
+def _entry_path(key, ext):
+    return os.path.join(CACHE_DIR, key + ext)
+
+
+def _touch(path):
+    # mtime doubles as the "last used" stamp for LRU eviction
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _atomic_save(path, writer):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict()
+
+
+def contains(key):
+    """Whether an entry (array or bundle) is cached under `key`, without loading it."""
+    return os.path.exists(_entry_path(key, ".npy")) or os.path.exists(_entry_path(key, ".npz"))
+
+
+def load_array(key):
+    """
+    Returns a cached array memory-mapped read-only, or None on a miss.
+    """
+    path = _entry_path(key, ".npy")
+    try:
+        arr = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    _touch(path)
+    return arr
+
+
+def save_array(key, arr):
+    _atomic_save(_entry_path(key, ".npy"), lambda f: np.save(f, np.ascontiguousarray(arr)))
+
+
+def load_arrays(key):
+    """
+    Returns a dict of cached arrays from an .npz bundle, or None on a miss.
+    """
+    path = _entry_path(key, ".npz")
+    try:
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+    _touch(path)
+    return arrays
+
+
+def save_arrays(key, **arrays):
+    _atomic_save(_entry_path(key, ".npz"), lambda f: np.savez(f, **arrays))
+
+
+def cached_array(audio_path, kind, params, compute):
+    """
+    Returns the feature `kind` of `audio_path` for `params`, computing and
+    storing it with `compute()` on a miss.
+    """
+    key = cache_key(audio_path, kind, **params)
+    arr = load_array(key)
+    if arr is None:
+        arr = compute()
+        save_array(key, arr)
+    return arr
+
+
+def cached_arrays(audio_path, kind, params, compute):
+    """
+    Like cached_array, for features made of several arrays; `compute()` must
+    return a dict of name -> array.
+    """
+    key = cache_key(audio_path, kind, **params)
+    arrays = load_arrays(key)
+    if arrays is None:
+        arrays = compute()
+        save_arrays(key, **arrays)
+    return arrays
+
+
+def evict(max_bytes=None):
+    """
+    Deletes least-recently-used entries until the cache fits in `max_bytes`.
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return
+    entries = []
+    total = 0
+    for name in names:
+        if not name.endswith((".npy", ".npz")):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st_ = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st_.st_mtime, st_.st_size, path))
+        total += st_.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # Another process may have evicted it or still have it mapped
+            continue
+        total -= size
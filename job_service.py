@@ -0,0 +1,305 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+import model_registry
+import separation as sep
+
+# Job states; the last three are final
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+
+
+class ServiceUnavailable(RuntimeError):
+    """The workers could not load their models."""
+
+
+# ==========================================
+# WORKER PROCESS
+# ==========================================
+# Cancelled ids a worker remembers for jobs it has not dequeued (yet): other
+# workers' jobs never reach it, so the oldest are forgotten beyond this
+MAX_CANCELLED_IDS = 4096
+
+
+def _drain(control, cancelled):
+    """Moves pending cancellations into `cancelled`, a dict used as an ordered set."""
+    while True:
+        try:
+            cancelled[control.get_nowait()] = True
+        except queue.Empty:
+            break
+    while len(cancelled) > MAX_CANCELLED_IDS:
+        del cancelled[next(iter(cancelled))]
+
+
+def _worker_main(index, jobs, events, control, loader, weights_dir, demucs_name, backend, threads):
+    """
+    Long-lived worker: loads the models once, then separates jobs from the
+    shared queue until it receives None. Cancellations arrive on `control`
+    and are checked before a job starts and after every chunk.
+    """
+    if threads:
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[var] = str(threads)
+        import torch
+        torch.set_num_threads(threads)
+    # The models load in the background while the weight files are hashed
+    model_registry.warm_up(weights_dir, demucs_name, backend, loader)
+    try:
+        import result_cache
+        model_id = result_cache.model_id(weights_dir, demucs_name, backend)
+        models = model_registry.get_models(weights_dir, demucs_name, backend, loader)
+    except Exception as e:
+        events.put(("worker_failed", index, f"{type(e).__name__}: {e}"))
+        return
+    events.put(("worker_ready", index, None))
+
+    cancelled = {}
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id = job["id"]
+        _drain(control, cancelled)
+        # A dequeued job is never seen again, so its id can be forgotten
+        if cancelled.pop(job_id, False):
+            events.put(("job", job_id, {"status": CANCELLED, "finished": time.time()}))
+            continue
+        events.put(("job", job_id, {"status": RUNNING, "worker": index, "started": time.time()}))
+        try:
+            stream = sep.stream_separation(job["input"], *models, out_dir=job["out_dir"],
+                                           chunk_seconds=job["chunk_seconds"],
+                                           memory_budget_mb=job["memory_budget_mb"],
+                                           model_id=model_id if job["use_cache"] else None)
+            for event in stream:
+                _drain(control, cancelled)
+                if cancelled.pop(job_id, False):
+                    # Closing the generator aborts its writer and removes partial files
+                    stream.close()
+                    events.put(("job", job_id, {"status": CANCELLED, "finished": time.time()}))
+                    break
+                if event["stage"] == "done":
+                    events.put(("job", job_id, {"status": DONE, "fraction": 1.0, "outputs": event["outputs"],
+                                                "cached": event["cached"], "finished": time.time()}))
+                else:
+                    events.put(("job", job_id, {"fraction": event["fraction"], "done": event["done"],
+                                                "total": event["total"]}))
+        except Exception as e:
+            events.put(("job", job_id, {"status": FAILED, "error": f"{type(e).__name__}: {e}",
+                                        "traceback": traceback.format_exc(), "finished": time.time()}))
+
+
+# ==========================================
+# SERVICE
+# ==========================================
+class JobService:
+    """
+    Local separation job service.
+
+    `workers` long-lived processes each load the models once and take jobs
+    from a queue bounded at `max_queue` entries: when it is full, submit()
+    raises queue.Full (or blocks, if asked to), which is the backpressure
+    signal for the caller. Progress and results are reported back by the
+    workers and read with status()/jobs(); cancel() stops a queued job before
+    it starts and a running one after its current chunk. A worker that dies
+    is replaced and its running job marked failed. With `memory_budget_mb`
+    (per worker) the chunk size is planned from the budget (see memory_plan).
+    Only the `keep_finished` most recently finished jobs are remembered.
+
+    `loader(weights_dir, demucs_name, backend)` returns (mixer, d_model,
+    m_model); it defaults to separation.load_models and must be importable
+    from a spawned process.
+    """
+
+    def __init__(self, workers=1, max_queue=8, out_dir="separated", weights_dir=sep.WEIGHTS_DIR,
+                 demucs_name="htdemucs", backend="torch", threads=None, loader=None, memory_budget_mb=None,
+                 keep_finished=200):
+        self.out_dir = out_dir
+        self.memory_budget_mb = memory_budget_mb
+        self.keep_finished = keep_finished
+        self.max_queue = max_queue
+        self._worker_args = (loader, weights_dir, demucs_name, backend, threads)
+        # spawn: forking a process that already runs torch threads can deadlock
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queue = self._ctx.Queue(max_queue)
+        self._events = self._ctx.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._workers = {}
+        self._ready = set()
+        self.error = None
+        self._closed = False
+        for index in range(workers):
+            self._start_worker(index)
+        self._collector = threading.Thread(target=self._collect, name="job-events", daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, index):
+        control = self._ctx.Queue()
+        process = self._ctx.Process(target=_worker_main, name=f"separation-worker-{index}", daemon=True,
+                                    args=(index, self._queue, self._events, control) + self._worker_args)
+        # spawn re-runs the parent's __main__ in the child; under `streamlit run`
+        # that is the whole dashboard, so present this module as __main__ instead
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = sys.modules[__name__]
+        try:
+            process.start()
+        finally:
+            sys.modules["__main__"] = main
+        self._workers[index] = (process, control)
+
+    # ------------------------------------------
+    # Event collection (background thread)
+    # ------------------------------------------
+    def _collect(self):
+        while not self._closed:
+            try:
+                kind, target, payload = self._events.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            with self._lock:
+                if kind == "job" and target in self._jobs:
+                    # A cancelled (or otherwise finished) job stays that way, whatever
+                    # its worker reports afterwards
+                    if self._jobs[target]["status"] not in FINAL_STATES:
+                        self._jobs[target].update(payload)
+                        self._prune()
+                elif kind == "worker_ready":
+                    self._ready.add(target)
+                elif kind == "worker_failed":
+                    self.error = payload
+                    self._workers.pop(target, None)
+                    if not self._workers:
+                        self._fail_pending(f"No separation worker available: {payload}")
+
+    def _check_workers(self):
+        with self._lock:
+            for index, (process, _) in list(self._workers.items()):
+                if process.is_alive() or self._closed:
+                    continue
+                for job in self._jobs.values():
+                    if job["status"] == RUNNING and job.get("worker") == index:
+                        job.update(status=FAILED, finished=time.time(),
+                                   error=f"Worker exited with code {process.exitcode}")
+                self._ready.discard(index)
+                self._start_worker(index)
+            self._prune()
+
+    def _prune(self):
+        """Forgets the oldest finished jobs beyond keep_finished (call with the lock held)."""
+        finished = [j for j in self._jobs.values() if j["status"] in FINAL_STATES]
+        if len(finished) > self.keep_finished:
+            finished.sort(key=lambda j: j.get("finished") or j["submitted"])
+            for job in finished[:len(finished) - self.keep_finished]:
+                del self._jobs[job["id"]]
+
+    def _fail_pending(self, error):
+        for job in self._jobs.values():
+            if job["status"] in (QUEUED, RUNNING):
+                job.update(status=FAILED, error=error, finished=time.time())
+
+    # ------------------------------------------
+    # Public API
+    # ------------------------------------------
+    def submit(self, input_path, chunk_seconds=sep.CHUNK_SECONDS, use_cache=True, block=False, timeout=None):
+        """
+        Queues a separation of `input_path`; stems go to <out_dir>/<job id>/.
+        Raises queue.Full when the queue is full (after `timeout` if `block`),
+        ServiceUnavailable if no worker could load the models.
+        Returns the job id.
+        """
+        if self._closed:
+            raise RuntimeError("JobService is shut down")
+        with self._lock:
+            if not self._workers:
+                raise ServiceUnavailable(self.error or "No separation worker available")
+        job_id = uuid.uuid4().hex[:12]
+        job = {"id": job_id, "input": os.path.abspath(input_path),
+               "out_dir": os.path.abspath(os.path.join(self.out_dir, job_id)),
+               "chunk_seconds": chunk_seconds, "use_cache": use_cache,
+               "memory_budget_mb": self.memory_budget_mb}
+        with self._lock:
+            self._jobs[job_id] = dict(job, status=QUEUED, fraction=0.0, submitted=time.time())
+        try:
+            self._queue.put(job, block=block, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job_id]
+            raise
+        return job_id
+
+    def status(self, job_id):
+        """A snapshot of one job's state, or None for an unknown id."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def jobs(self):
+        """Snapshots of every job, oldest first."""
+        with self._lock:
+            return sorted((dict(j) for j in self._jobs.values()), key=lambda j: j["submitted"])
+
+    def cancel(self, job_id):
+        """Requests cancellation; returns False if the job is unknown or already finished."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] in FINAL_STATES:
+                return False
+            job["cancel_requested"] = True
+            if job["status"] == QUEUED:
+                # Its queue slot is freed when a worker pops and skips it
+                job.update(status=CANCELLED, finished=time.time())
+            # Any worker may dequeue it, so every worker hears about it
+            for _, control in self._workers.values():
+                control.put(job_id)
+            self._prune()
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"workers": len(self._workers), "ready": len(self._ready), "max_queue": self.max_queue,
+                    "jobs": counts, "error": self.error}
+
+    def shutdown(self, wait=True):
+        """Stops the workers after their current job; queued jobs are dropped."""
+        if self._closed:
+            return
+        self._closed = True
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                with self._lock:
+                    # A job cancelled while queued may have been pruned already
+                    entry = self._jobs.get(job["id"])
+                    if entry is not None and entry["status"] not in FINAL_STATES:
+                        entry.update(status=CANCELLED, finished=time.time())
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for process, _ in self._workers.values():
+            if wait:
+                process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        self._collector.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import separation as sep
+
+STAGES = ("demucs", "mdx", "stem_mixer")
+COSTS_PATH = os.environ.get("SPECTACLES_MEMORY_COSTS", os.path.join(".cache", "memory_costs.json"))
+
+# Working memory of each stage on top of the loaded models: fixed_mb + per_second_mb
+# per second of chunk. Demucs and StemMixer were measured with `--measure` (htdemucs
+# architecture, CPU); MDX ships without weights here, so its entry is a conservative
+# estimate. A measured costs file at COSTS_PATH takes precedence.
+DEFAULT_COSTS = {
+    "demucs": {"fixed_mb": 440.0, "per_second_mb": 6.0},
+    "mdx": {"fixed_mb": 300.0, "per_second_mb": 60.0},
+    "stem_mixer": {"fixed_mb": 0.0, "per_second_mb": 110.0},
+}
+
+# The chunk itself, both branch outputs and the mixed stems: float32 (2 + 3 * 4 * 2) x MODEL_SR
+IO_MB_PER_SECOND = (2 + 3 * len(sep.STEMS) * 2) * 4 * sep.MODEL_SR / 2 ** 20
+
+MIN_CHUNK_SECONDS = 2.0
+MAX_CHUNK_SECONDS = 60.0
+# Overlap as a share of the chunk: the paper's 1 s per 10 s chunk, never above OVERLAP_SECONDS
+OVERLAP_FRACTION = 0.1
+MIN_OVERLAP_SECONDS = 0.25
+
+
+def rss_mb():
+    """Current resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        from profiling import _rss_peak_mb
+        return _rss_peak_mb() or 0.0
+
+
+def load_costs(path=COSTS_PATH):
+    """Per-stage costs: the measured file if there is one, DEFAULT_COSTS for any stage it lacks."""
+    costs = {name: dict(cost) for name, cost in DEFAULT_COSTS.items()}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            costs.update(json.load(f)["stages"])
+    return costs
+
+
+def peak_mb(chunk_seconds, costs=None, mode="serial"):
+    """
+    Estimated working memory of separating one chunk. Serial runs one stage
+    at a time; in thread/process mode the next chunk's branches run while the
+    current one is mixed, so all three stages are live at once.
+    """
+    costs = costs or load_costs()
+    stage_mb = [costs[name]["fixed_mb"] + costs[name]["per_second_mb"] * chunk_seconds for name in STAGES]
+    working = max(stage_mb) if mode == "serial" else sum(stage_mb)
+    return working + IO_MB_PER_SECOND * chunk_seconds * (1 if mode == "serial" else 2)
+
+
+def plan(budget_mb, mode="serial", costs=None, resident_mb=None):
+    """
+    Largest chunk (and its overlap) whose estimated peak fits in `budget_mb`,
+    the memory this process may use in total. `resident_mb` is what it holds
+    already (default: its current RSS, so call this after loading the models).
+    Raises ValueError if not even a MIN_CHUNK_SECONDS chunk fits.
+    """
+    costs = costs or load_costs()
+    resident_mb = rss_mb() if resident_mb is None else resident_mb
+    available = budget_mb - resident_mb
+
+    # peak_mb is piecewise linear and increasing in the chunk length: bisect it
+    lo, hi = 0.0, MAX_CHUNK_SECONDS
+    if peak_mb(hi, costs, mode) <= available:
+        lo = hi
+    else:
+        for _ in range(40):
+            mid = (lo + hi) / 2
+            lo, hi = (mid, hi) if peak_mb(mid, costs, mode) <= available else (lo, mid)
+    chunk_seconds = math.floor(lo * 2) / 2
+    if chunk_seconds < MIN_CHUNK_SECONDS:
+        raise ValueError(f"A {budget_mb:.0f} MB budget leaves {available:.0f} MB beside {resident_mb:.0f} MB "
+                         f"resident; a {MIN_CHUNK_SECONDS:g}s chunk needs "
+                         f"{peak_mb(MIN_CHUNK_SECONDS, costs, mode):.0f} MB")
+    overlap_seconds = float(np.clip(round(chunk_seconds * OVERLAP_FRACTION, 2),
+                                    MIN_OVERLAP_SECONDS, sep.OVERLAP_SECONDS))
+    return {"chunk_seconds": chunk_seconds, "overlap_seconds": overlap_seconds,
+            "peak_mb": round(peak_mb(chunk_seconds, costs, mode), 1),
+            "available_mb": round(available, 1), "mode": mode}
+
+
+# ==========================================
+# MEASUREMENT
+# ==========================================
+class _PeakSampler:
+    """Polls the RSS on a background thread: ru_maxrss cannot be reset between runs."""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+
+def _measure_one(stage_name, seconds, weights_dir, demucs_name, backend, loader):
+    import torch
+
+    import model_registry
+    from synthetic import synthetic_signal
+
+    mixer, d_model, m_model = model_registry.get_models(weights_dir, demucs_name, backend, loader)
+    chunk = sep.pad_chunk(np.ascontiguousarray(synthetic_signal(seconds, sep.MODEL_SR).T))
+    branch_out = torch.from_numpy(np.repeat(chunk[None], len(sep.STEMS), axis=0) / len(sep.STEMS))
+    # One short warm-up run, so lazy initialisation is not counted as working memory
+    warm = chunk[:, :sep.MODEL_SR]
+    runs = {
+        "demucs": lambda c: sep.run_demucs(d_model, c),
+        "mdx": lambda c: sep.run_mdx(m_model, c),
+        "stem_mixer": lambda c: sep.mix_chunk(mixer, branch_out[..., :c.shape[1]],
+                                              branch_out[..., :c.shape[1]], c.shape[1]),
+    }
+    runs[stage_name](warm)
+    with _PeakSampler() as sampler:
+        base = rss_mb()
+        runs[stage_name](chunk)
+    return sampler.peak - base
+
+
+def measure_costs(weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch", loader=None,
+                  seconds=(4.0, 12.0), path=COSTS_PATH):
+    """
+    Measures every stage's peak RSS growth at two chunk lengths, each run in
+    a fresh process, and fits fixed_mb + per_second_mb * seconds through them.
+    `loader` is as for JobService. Writes the costs to `path` and returns them.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    stages = {}
+    for stage_name in STAGES:
+        peaks = []
+        for s in seconds:
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                peaks.append(pool.submit(_measure_one, stage_name, s, weights_dir, demucs_name,
+                                         backend, loader).result())
+        slope = max((peaks[1] - peaks[0]) / (seconds[1] - seconds[0]), 0.0)
+        stages[stage_name] = {"fixed_mb": round(max(peaks[0] - slope * seconds[0], 0.0), 1),
+                              "per_second_mb": round(slope, 2)}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"stages": stages, "seconds": list(seconds), "demucs": demucs_name, "backend": backend,
+                   "python": sys.version.split()[0], "time": time.time()}, f, indent=2)
+    return stages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the separation chunk size for a memory budget.")
+    parser.add_argument("budget_mb", type=float, nargs="?", help="Memory budget of the separation process (MB)")
+    parser.add_argument("--mode", choices=("serial", "thread", "process"), default="serial")
+    parser.add_argument("--resident-mb", type=float, default=None,
+                        help="Memory held besides the working set (default: measured by loading the models)")
+    parser.add_argument("--measure", action="store_true", help="Measure the per-stage costs on this host first")
+    parser.add_argument("--weights", default=sep.WEIGHTS_DIR)
+    parser.add_argument("--demucs", default="htdemucs")
+    parser.add_argument("--backend", choices=("torch", "onnx", "onnx-int8"), default="torch")
+    args = parser.parse_args()
+
+    if args.measure:
+        for name, cost in measure_costs(args.weights, args.demucs, args.backend).items():
+            print(f"{name:<11} {cost['fixed_mb']:8.1f} MB + {cost['per_second_mb']:6.2f} MB/s")
+        print(f"Saved to {COSTS_PATH}")
+    if args.budget_mb is not None:
+        resident = args.resident_mb
+        if resident is None:
+            import model_registry
+            model_registry.get_models(args.weights, args.demucs, args.backend)
+            resident = rss_mb()
+        p = plan(args.budget_mb, args.mode, resident_mb=resident)
+        print(f"chunk {p['chunk_seconds']:g}s, overlap {p['overlap_seconds']:g}s "
+              f"(~{p['peak_mb']:.0f} MB working set of {p['available_mb']:.0f} MB available)")
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import separation as sep
+
+# Process-wide model cache: one entry per (weights_dir, demucs_name, backend).
+# Nothing heavy is imported until a model set is first requested.
+_entries = {}
+_errors = {}
+_lock = threading.Lock()
+
+
+def _key(weights_dir, demucs_name, backend):
+    return os.path.abspath(weights_dir), demucs_name, backend
+
+
+def get_models(weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch", loader=None):
+    """
+    (mixer, d_model, m_model) for this configuration, loaded once per process
+    with `loader` (default separation.load_models). Concurrent callers wait
+    for the first load instead of starting their own; a failed load is not
+    cached, so the next call retries.
+    """
+    key = _key(weights_dir, demucs_name, backend)
+    with _lock:
+        entry = _entries.get(key)
+        owner = entry is None
+        if owner:
+            entry = _entries[key] = {"ready": threading.Event(), "models": None, "error": None}
+
+    if not owner:
+        entry["ready"].wait()
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["models"]
+
+    try:
+        entry["models"] = (loader or sep.load_models)(weights_dir, demucs_name, backend)
+    except Exception as e:
+        entry["error"] = e
+        with _lock:
+            _entries.pop(key, None)
+            _errors[key] = e
+        raise
+    finally:
+        entry["ready"].set()
+    with _lock:
+        _errors.pop(key, None)
+    return entry["models"]
+
+
+def warm_up(weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch", loader=None):
+    """
+    Loads the models on a background thread so the first request does not
+    pay for the imports and weight loading. Returns the (daemon) thread; a
+    load error shows in status() and error(), and get_models() retries.
+    """
+    def load():
+        try:
+            get_models(weights_dir, demucs_name, backend, loader)
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=load, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def status(weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch"):
+    """"ready", "loading", "failed" (see error()) or None if never requested."""
+    key = _key(weights_dir, demucs_name, backend)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return "failed" if key in _errors else None
+    return "ready" if entry["ready"].is_set() and entry["error"] is None else "loading"
+
+
+def error(weights_dir=sep.WEIGHTS_DIR, demucs_name="htdemucs", backend="torch"):
+    """The exception of the last failed load, if any."""
+    with _lock:
+        return _errors.get(_key(weights_dir, demucs_name, backend))
+
+
+def clear():
+    """Drops every cached model set (their memory is freed once unreferenced)."""
+    with _lock:
+        _entries.clear()
+        _errors.clear()
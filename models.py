@@ -0,0 +1,27 @@
+import torch
+import torch.nn as nn
+
+
+class StemMixer(nn.Module):
+    """
+    Learned ensemble router (paper §3.2).
+    Input: (Batch, 4, Freq, Time) magnitude spectrograms - Demucs L/R and MDX L/R.
+    Output: (Batch, 2, Freq, Time) mixing mask α in [0, 1] for the L/R channels.
+    The MLP runs on the channel dimension, i.e. 1x1 convolutions.
+    """
+
+    def __init__(self, in_channels=4, hidden=32, bottleneck=16, out_channels=2):
+        super().__init__()
+        self.net = nn.Sequential(
+            nn.Conv2d(in_channels, hidden, kernel_size=1),
+            nn.BatchNorm2d(hidden),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(hidden, bottleneck, kernel_size=1),
+            nn.BatchNorm2d(bottleneck),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(bottleneck, out_channels, kernel_size=1),
+            nn.Sigmoid(),
+        )
+
+    def forward(self, x):
+        return self.net(x)
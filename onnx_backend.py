@@ -0,0 +1,189 @@
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+import separation as sep
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+MIXER_ONNX = "stem_mixer.onnx"
+MDX_ONNX = "mdx.onnx"
+
+
+def onnx_path(weights_dir, name, int8=False):
+    base, ext = os.path.splitext(name)
+    return os.path.join(weights_dir, f"{base}.int8{ext}" if int8 else name)
+
+
+def _write_atomic(path, write):
+    """
+    Runs write(tmp_path) on a unique temp file next to `path`, then renames it
+    into place: concurrent workers see either no model or a complete one.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                               suffix=".part")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+# ==========================================
+# EXPORT
+# ==========================================
+def export_mixer(mixer, path):
+    import torch
+
+    dummy = torch.rand(4, 4, sep.N_FFT // 2 + 1, 64)
+    axes = {0: "batch", 2: "freq", 3: "time"}
+    torch.onnx.export(mixer.eval(), (dummy,), path, input_names=["spec"], output_names=["alpha"],
+                      dynamic_axes={"spec": axes, "alpha": axes}, do_constant_folding=True,
+                      dynamo=False)
+    return path
+
+
+def export_mdx(m_model, path):
+    import torch
+
+    dummy = torch.rand(1, 2, int(sep.CHUNK_SECONDS * sep.MODEL_SR))
+    torch.onnx.export(m_model.eval(), (dummy,), path, input_names=["mix"], output_names=["stems"],
+                      dynamic_axes={"mix": {0: "batch", 2: "time"}, "stems": {0: "batch", 3: "time"}},
+                      do_constant_folding=True, dynamo=False)
+    return path
+
+
+def quantize_int8(src_path, dst_path):
+    """int8 dynamic quantization of the Conv/MatMul weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(src_path, dst_path, weight_type=QuantType.QInt8,
+                     op_types_to_quantize=["Conv", "MatMul", "Gemm"])
+    return dst_path
+
+
+def export_all(weights_dir=sep.WEIGHTS_DIR, int8=False):
+    """
+    Exports StemMixer and MDX from their PyTorch weights in `weights_dir`
+    (and int8 variants if requested). Returns the written paths.
+    """
+    mixer, m_model = sep.load_mixer(weights_dir), sep.load_mdx(weights_dir)
+    paths = [_write_atomic(onnx_path(weights_dir, MIXER_ONNX), lambda p: export_mixer(mixer, p)),
+             _write_atomic(onnx_path(weights_dir, MDX_ONNX), lambda p: export_mdx(m_model, p))]
+    if int8:
+        paths += [_write_atomic(onnx_path(weights_dir, os.path.basename(src), int8=True),
+                                lambda p, src=src: quantize_int8(src, p))
+                  for src in list(paths)]
+    return paths
+
+
+# ==========================================
+# RUNTIME
+# ==========================================
+class OrtModule:
+    """
+    Wraps an ONNX Runtime session so it can stand in for the torch module it
+    was exported from: takes and returns torch tensors.
+    """
+
+    def __init__(self, path, n_threads=None):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if n_threads:
+            opts.intra_op_num_threads = n_threads
+        self.path = path
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        import torch
+
+        x = x.detach().cpu().numpy() if isinstance(x, torch.Tensor) else np.asarray(x)
+        out = self.session.run(None, {self.input_name: np.ascontiguousarray(x, dtype=np.float32)})[0]
+        return torch.from_numpy(out)
+
+    def eval(self):
+        return self
+
+
+def _load_onnx(weights_dir, name, int8, export_one, n_threads):
+    """
+    Loads an ONNX model, exporting (and quantizing) it from torch weights if
+    missing. Exports go through a temp file, so workers racing on a cold cache
+    each write their own and the last rename wins.
+    """
+    path = onnx_path(weights_dir, name, int8)
+    if not os.path.exists(path):
+        fp32_path = onnx_path(weights_dir, name)
+        if not os.path.exists(fp32_path):
+            _write_atomic(fp32_path, export_one)
+        if int8:
+            _write_atomic(path, lambda p: quantize_int8(fp32_path, p))
+    return OrtModule(path, n_threads)
+
+
+def load_onnx_mixer(weights_dir=sep.WEIGHTS_DIR, int8=False, n_threads=None):
+    return _load_onnx(weights_dir, MIXER_ONNX, int8,
+                      lambda p: export_mixer(sep.load_mixer(weights_dir), p), n_threads)
+
+
+def load_onnx_mdx(weights_dir=sep.WEIGHTS_DIR, int8=False, n_threads=None):
+    return _load_onnx(weights_dir, MDX_ONNX, int8,
+                      lambda p: export_mdx(sep.load_mdx(weights_dir), p), n_threads)
+
+
+# ==========================================
+# PARITY CHECK
+# ==========================================
+def sdr(reference, estimate):
+    """Signal-to-Distortion Ratio (dB) of `estimate` against `reference`."""
+    reference = np.asarray(reference, dtype=np.float64)
+    noise = reference - np.asarray(estimate, dtype=np.float64)
+    return 10 * np.log10((np.sum(reference ** 2) + 1e-12) / (np.sum(noise ** 2) + 1e-12))
+
+
+def parity_check(audio_path, weights_dir=sep.WEIGHTS_DIR, int8=False, seconds=sep.CHUNK_SECONDS,
+                 demucs_name="htdemucs"):
+    """
+    Separates the first `seconds` of `audio_path` with the PyTorch and ONNX
+    backends (same Demucs output) and reports the SDR of the ONNX stems
+    against the PyTorch ones, per stem. Higher is closer; > ~60 dB is noise.
+    """
+    chunk = next(sep.read_chunks(audio_path, int(seconds * sep.MODEL_SR), 0))[1]
+    padded = sep.pad_chunk(chunk)
+    d_out = sep.run_demucs(sep.load_demucs(demucs_name), padded)
+
+    torch_stems = sep.mix_chunk(sep.load_mixer(weights_dir), d_out,
+                                sep.run_mdx(sep.load_mdx(weights_dir), padded), chunk.shape[1])
+    onnx_stems = sep.mix_chunk(load_onnx_mixer(weights_dir, int8), d_out,
+                               sep.run_mdx(load_onnx_mdx(weights_dir, int8), padded), chunk.shape[1])
+    return {stem: float(sdr(t, o)) for stem, t, o in zip(sep.STEMS, torch_stems, onnx_stems)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export SpecTacles models to ONNX and check parity.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export")
+    p_parity = sub.add_parser("parity")
+    p_parity.add_argument("audio")
+    p_parity.add_argument("--seconds", type=float, default=sep.CHUNK_SECONDS)
+    for p in (p_export, p_parity):
+        p.add_argument("--weights", default=sep.WEIGHTS_DIR)
+        p.add_argument("--int8", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for path in export_all(args.weights, args.int8):
+            print(f"Exported: {path}")
+    else:
+        report = parity_check(args.audio, args.weights, args.int8, args.seconds)
+        for stem, value in report.items():
+            print(f"{stem:<8} SDR vs PyTorch: {value:6.2f} dB")
@@ -0,0 +1,218 @@
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+
+# Recorder of the current run (a Streamlit rerun, a batch track, ...); stages
+# outside any run cost two clock reads and are dropped.
+_current = contextvars.ContextVar("spectacles_profile_run", default=None)
+_stack = threading.local()
+
+# Holders that want tracemalloc on (e.g. one token per Streamlit session)
+_memory_users = weakref.WeakSet()
+_memory_lock = threading.Lock()
+
+# tracemalloc's peak is process-wide, so a stage's memory figure is only valid
+# while no stage of another thread runs: the open stages of every thread share
+# one window, and a second thread entering it marks the whole window overlapped
+_window_lock = threading.Lock()
+_window = {"threads": {}, "overlap": False}
+
+
+def _rss_peak_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class Recorder:
+    """Collects the stage records of one run."""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def summary(self):
+        """
+        Per-stage totals: calls, wall/CPU seconds and the memory high-water mark.
+        mem_unmeasured counts the calls that overlapped a stage of another
+        thread or session and so have no mem_peak_mb.
+        """
+        rows = {}
+        for r in self.records:
+            row = rows.setdefault(r["name"], {"stage": r["name"], "calls": 0, "wall_s": 0.0,
+                                              "cpu_s": 0.0, "mem_peak_mb": None, "rss_peak_mb": None,
+                                              "mem_unmeasured": 0})
+            row["calls"] += 1
+            row["wall_s"] += r["wall_s"]
+            row["cpu_s"] += r["cpu_s"]
+            row["mem_unmeasured"] += bool(r.get("mem_overlap"))
+            for key in ("mem_peak_mb", "rss_peak_mb"):
+                if r[key] is not None:
+                    row[key] = max(row[key] or 0.0, r[key])
+        return sorted(rows.values(), key=lambda row: -row["wall_s"])
+
+    def chrome_trace(self):
+        """The records as a Chrome trace (load in chrome://tracing or Perfetto)."""
+        events = [{
+            "name": r["name"], "ph": "X", "pid": os.getpid(), "tid": r["thread"],
+            "ts": r["start_s"] * 1e6, "dur": r["wall_s"] * 1e6,
+            "args": {"cpu_ms": r["cpu_s"] * 1e3, "mem_peak_mb": r["mem_peak_mb"],
+                     "rss_peak_mb": r["rss_peak_mb"]},
+        } for r in self.records]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"run": self.name}}
+
+    def export_chrome_trace(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+def start_run(name="run"):
+    """Starts a new recorder for the current context and returns it."""
+    recorder = Recorder(name)
+    _current.set(recorder)
+    return recorder
+
+
+def current_run():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def run(name="run"):
+    """
+    A recorder scoped to a block, e.g. a Streamlit fragment that can rerun on
+    its own. On exit the enclosing run is restored and also gets the block's
+    records, so a full rerun still reports every stage.
+    """
+    parent = _current.get()
+    recorder = Recorder(name)
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            shift = recorder.t0 - parent.t0
+            for r in recorder.records:
+                parent.add(dict(r, start_s=r["start_s"] + shift))
+
+
+class MemoryToken:
+    """A holder for track_memory(); keep one per session."""
+
+
+def track_memory(user, enabled=True):
+    """
+    Asks for (or releases) per-stage memory high-water marks via tracemalloc
+    (numpy buffers included) on behalf of `user`, a MemoryToken. Tracing is
+    process-wide and slows allocations down, so it runs while at least one
+    user wants it: one session switching it off does not stop it for another,
+    and a user that is garbage collected (an expired session) releases it.
+    """
+    with _memory_lock:
+        if enabled:
+            _memory_users.add(user)
+        else:
+            _memory_users.discard(user)
+        wanted = len(_memory_users) > 0
+        if wanted and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not wanted and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+class stage(contextlib.ContextDecorator):
+    """
+    Times a pipeline stage: wall time, CPU time of the calling thread and
+    memory high-water mark. Use as `with stage("decode"):` or `@stage("decode")`.
+    mem_peak_mb is the tracemalloc peak above the stage's starting point when
+    track_memory() is on (Python and numpy allocations, not torch's). The peak
+    is process-wide, so it is only reported for stages that ran while no other
+    thread was inside a stage; overlapped stages record mem_overlap instead.
+    rss_peak_mb is always the process peak RSS.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call keeps concurrent calls apart
+        return stage(self.name)
+
+    def __enter__(self):
+        recorder = _current.get()
+        frame = {"recorder": recorder}
+        if recorder is not None:
+            frames = getattr(_stack, "frames", None)
+            if frames is None:
+                frames = _stack.frames = []
+            thread = threading.get_ident()
+            with _window_lock:
+                threads = _window["threads"]
+                if not threads:
+                    _window["overlap"] = False
+                elif thread not in threads:
+                    _window["overlap"] = True
+                threads[thread] = threads.get(thread, 0) + 1
+                frame["traced"] = tracemalloc.is_tracing()
+                frame["clean"] = not _window["overlap"]
+                if frame["traced"] and frame["clean"]:
+                    current, peak = tracemalloc.get_traced_memory()
+                    # reset_peak() below would hide the enclosing stage's peak so far
+                    if frames:
+                        frames[-1]["peak_seen"] = max(frames[-1].get("peak_seen", 0), peak)
+                    tracemalloc.reset_peak()
+                    frame["mem_start"] = current
+            frame["cpu"] = time.thread_time()
+            frame["wall"] = time.perf_counter()
+            frames.append(frame)
+        self._frame = frame
+        return self
+
+    def __exit__(self, *exc):
+        frame = self._frame
+        recorder = frame["recorder"]
+        if recorder is None:
+            return False
+        wall = time.perf_counter() - frame["wall"]
+        cpu = time.thread_time() - frame["cpu"]
+        frames = _stack.frames
+        frames.pop()
+
+        mem_peak = None
+        thread = threading.get_ident()
+        with _window_lock:
+            overlap = _window["overlap"] or not frame["clean"]
+            if "mem_start" in frame and not overlap and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], frame.get("peak_seen", 0))
+                mem_peak = (peak - frame["mem_start"]) / 2 ** 20
+                if frames:
+                    frames[-1]["peak_seen"] = max(frames[-1].get("peak_seen", 0), peak)
+            threads = _window["threads"]
+            threads[thread] -= 1
+            if not threads[thread]:
+                del threads[thread]
+
+        recorder.add({"name": self.name, "start_s": frame["wall"] - recorder.t0, "wall_s": wall,
+                      "cpu_s": cpu, "mem_peak_mb": mem_peak, "rss_peak_mb": _rss_peak_mb(),
+                      "mem_overlap": frame["traced"] and overlap,
+                      "thread": threading.get_ident(),
+                      "depth": len(frames)})
+        return False
@@ -0,0 +1,211 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+import separation as sep
+from branches import BranchRunner
+
+# Defaults: 0.5 s hops with 3 s of past context and 0.25 s look-ahead
+HOP_SECONDS = 0.5
+CONTEXT_SECONDS = 3.0
+LOOKAHEAD_SECONDS = 0.25
+FADE_SECONDS = 0.05
+
+
+class RingBuffer:
+    """Fixed-size stereo ring buffer holding the most recent `size` samples."""
+
+    def __init__(self, size, channels=2):
+        self.data = np.zeros((channels, size), dtype=np.float32)
+        self.size = size
+        self.pos = 0
+
+    def write(self, block):
+        n = block.shape[1]
+        if n >= self.size:
+            self.data[:] = block[:, -self.size:]
+            self.pos = 0
+            return
+        end = self.pos + n
+        if end <= self.size:
+            self.data[:, self.pos:end] = block
+        else:
+            split = self.size - self.pos
+            self.data[:, self.pos:] = block[:, :split]
+            self.data[:, :end - self.size] = block[:, split:]
+        self.pos = end % self.size
+
+    def latest(self):
+        """The whole buffer in time order (oldest first)."""
+        return np.concatenate([self.data[:, self.pos:], self.data[:, :self.pos]], axis=1)
+
+
+class RealtimeSeparator:
+    """
+    Block-based low-latency separation on top of the Demucs/MDX/StemMixer pipeline.
+
+    Input arrives in arbitrary blocks; every `hop` new samples the models run
+    over a ring buffer window of [context | hop | lookahead] and the hop region
+    is emitted. Only `lookahead` future samples are ever used, so the
+    algorithmic latency is fixed at hop + lookahead (lookahead=0 is causal).
+    Consecutive hops are crossfaded over up to FADE_SECONDS of the look-ahead.
+    """
+
+    def __init__(self, mixer, d_model, m_model, hop_seconds=HOP_SECONDS,
+                 context_seconds=CONTEXT_SECONDS, lookahead_seconds=LOOKAHEAD_SECONDS,
+                 mode="serial", on_late=None):
+        self.mixer = mixer
+        self.hop = int(hop_seconds * sep.MODEL_SR)
+        self.context = int(context_seconds * sep.MODEL_SR)
+        self.lookahead = int(lookahead_seconds * sep.MODEL_SR)
+        self.fade = min(int(FADE_SECONDS * sep.MODEL_SR), self.lookahead)
+        self.fade_in = ((np.arange(self.fade) + 0.5) / max(self.fade, 1)).astype(np.float32)
+
+        self.ring = RingBuffer(self.context + self.hop + self.lookahead)
+        self.runner = BranchRunner(d_model, m_model, mode=mode)
+        self.on_late = on_late
+
+        self.pending = 0          # input samples received since the last hop
+        self.received = 0         # total input samples
+        self.emitted = -self.lookahead  # absolute index of the next output sample
+        self.tail = None          # previous window's first look-ahead samples, for crossfading
+        self.started = None
+        self.stats = {"hops": 0, "late_hops": 0, "max_hop_seconds": 0.0,
+                      "total_compute_seconds": 0.0, "behind_seconds": 0.0}
+
+    @property
+    def latency_seconds(self):
+        return (self.hop + self.lookahead) / sep.MODEL_SR
+
+    def _run_hop(self):
+        t0 = time.perf_counter()
+        window = sep.pad_chunk(self.ring.latest())
+        d_out, m_out = self.runner.result(self.runner.submit(window))
+        stems = sep.mix_chunk(self.mixer, d_out, m_out, window.shape[1])
+
+        out = stems[..., self.context:self.context + self.hop].copy()
+        if self.tail is not None and self.fade:
+            out[..., :self.fade] = self.tail * (1 - self.fade_in) + out[..., :self.fade] * self.fade_in
+        self.tail = stems[..., self.context + self.hop:self.context + self.hop + self.fade]
+
+        elapsed = time.perf_counter() - t0
+        self._account(elapsed)
+        return out
+
+    def _account(self, elapsed):
+        stats = self.stats
+        stats["hops"] += 1
+        stats["total_compute_seconds"] += elapsed
+        stats["max_hop_seconds"] = max(stats["max_hop_seconds"], elapsed)
+        # Wall clock since the first block vs. audio delivered (+ allowed latency)
+        delivered = max(self.emitted + self.hop, 0) / sep.MODEL_SR
+        behind = time.perf_counter() - self.started - delivered - self.latency_seconds
+        stats["behind_seconds"] = max(behind, 0.0)
+        if elapsed > self.hop / sep.MODEL_SR or behind > 0:
+            stats["late_hops"] += 1
+            if self.on_late is not None:
+                self.on_late(dict(stats, hop_seconds=elapsed))
+
+    def process(self, block):
+        """
+        Feeds a (2, n) input block. Returns the (4, 2, m) stem samples that
+        became final, aligned so output sample k matches input sample k.
+        """
+        if self.started is None:
+            self.started = time.perf_counter()
+        outputs = []
+        offset = 0
+        while offset < block.shape[1]:
+            take = min(self.hop - self.pending, block.shape[1] - offset)
+            self.ring.write(block[:, offset:offset + take])
+            self.pending += take
+            self.received += take
+            offset += take
+            if self.pending == self.hop:
+                self.pending = 0
+                out = self._run_hop()
+                start = self.emitted
+                self.emitted += self.hop
+                if self.emitted > 0:
+                    outputs.append(out[..., max(-start, 0):])
+        if not outputs:
+            return np.zeros((len(sep.STEMS), 2, 0), dtype=np.float32)
+        return np.concatenate(outputs, axis=-1)
+
+    def flush(self):
+        """Drains the look-ahead with silence; returns the remaining aligned output."""
+        if self.received <= self.emitted:
+            return np.zeros((len(sep.STEMS), 2, 0), dtype=np.float32)
+        n_hops = -(-(self.received - self.emitted) // self.hop)
+        remaining = self.received - max(self.emitted, 0)
+        out = self.process(np.zeros((2, n_hops * self.hop - self.pending), dtype=np.float32))
+        return out[..., :remaining]
+
+    def close(self):
+        self.runner.close()
+
+
+def file_source(input_path, block_seconds=HOP_SECONDS / 2, paced=False):
+    """
+    Yields (2, n) blocks from a file. With `paced`, blocks are released at the
+    rate a live input device would deliver them (a local stand-in stream).
+    """
+    block_frames = int(block_seconds * sep.MODEL_SR)
+    start = time.perf_counter()
+    delivered = 0
+    for block in sep.decode_blocks(input_path, block_frames=block_frames):
+        if paced:
+            wait = start + delivered / sep.MODEL_SR - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        delivered += block.shape[1]
+        yield block
+
+
+def run_realtime(source, separator, out_dir=".", timestamp=None):
+    """
+    Runs `separator` over a block source and streams the stems to
+    `<out_dir>/<Stem>_<timestamp>.mp3`. Returns (outputs, stats).
+    """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    outputs = {stem: os.path.join(out_dir, f"{stem}_{timestamp}.mp3") for stem in sep.STEMS}
+    os.makedirs(out_dir, exist_ok=True)
+    writer = sep.StemWriter([outputs[stem] for stem in sep.STEMS], overlap=0)
+    try:
+        for block in source:
+            stems = separator.process(block)
+            if stems.shape[-1]:
+                writer.push(stems)
+        writer.push(separator.flush())
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        separator.close()
+    return outputs, separator.stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Low-latency streaming separation.")
+    parser.add_argument("input")
+    parser.add_argument("--out-dir", default=".")
+    parser.add_argument("--hop", type=float, default=HOP_SECONDS)
+    parser.add_argument("--context", type=float, default=CONTEXT_SECONDS)
+    parser.add_argument("--lookahead", type=float, default=LOOKAHEAD_SECONDS)
+    parser.add_argument("--mode", choices=("serial", "thread"), default="serial")
+    parser.add_argument("--paced", action="store_true", help="Feed the file at real-time speed")
+    args = parser.parse_args()
+
+    def report_late(stats):
+        print(f"[late] hop took {stats['hop_seconds']:.3f}s, behind real time by {stats['behind_seconds']:.3f}s")
+
+    mixer, d_model, m_model = sep.load_models()
+    separator = RealtimeSeparator(mixer, d_model, m_model, args.hop, args.context, args.lookahead,
+                                  mode=args.mode, on_late=report_late)
+    print(f"Algorithmic latency: {separator.latency_seconds * 1000:.0f} ms")
+    outputs, stats = run_realtime(file_source(args.input, paced=args.paced), separator, args.out_dir)
+    print("Output files:", outputs)
+    print(f"Hops: {stats['hops']} | late: {stats['late_hops']} | worst hop: {stats['max_hop_seconds']:.3f}s")
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import feature_cache
+
+# Location and size budget can be overridden from the environment
+CACHE_DIR = os.environ.get("SPECTACLES_RESULT_CACHE_DIR", os.path.join(".cache", "separations"))
+MAX_CACHE_BYTES = int(os.environ.get("SPECTACLES_RESULT_CACHE_MB", "2048")) * 1024 * 1024
+
+# An eviction lock older than this is assumed to belong to a crashed process
+STALE_LOCK_SECONDS = 120
+
+
+def model_id(weights_dir, demucs_name="htdemucs", backend="torch"):
+    """
+    Identifies a set of loaded models: Demucs variant, backend and the content
+    hashes of the StemMixer/MDX weight files, so retrained weights never hit
+    stale results.
+    """
+    weights = {}
+    for name in ("stem_mixer.pth", "mdx.pt"):
+        path = os.path.join(weights_dir, name)
+        weights[name] = feature_cache.file_digest(path) if os.path.exists(path) else None
+    payload = json.dumps({"demucs": demucs_name, "backend": backend, "weights": weights}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def result_key(input_path, model, **params):
+    """Cache key: audio content hash + model identifier + engine parameters."""
+    payload = json.dumps({"audio": feature_cache.file_digest(input_path), "model": model,
+                          "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _entry_dir(key):
+    return os.path.join(CACHE_DIR, key)
+
+
+def lookup(key, stems):
+    """Returns {stem: cached path} if the entry is complete, else None."""
+    entry = _entry_dir(key)
+    paths = {stem: os.path.join(entry, f"{stem}.mp3") for stem in stems}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    try:
+        # Directory mtime is the "last used" stamp for LRU eviction
+        os.utime(entry, None)
+    except OSError:
+        pass
+    return paths
+
+
+def store(key, outputs):
+    """
+    Copies finished stems ({stem: path}) into the cache.
+    The entry is assembled in a private temp directory and renamed into place,
+    which is atomic: concurrent writers of the same key cannot interleave, the
+    first rename wins and later ones are discarded.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = os.path.join(CACHE_DIR, f"tmp-{uuid.uuid4().hex}")
+    os.makedirs(tmp)
+    try:
+        for stem, path in outputs.items():
+            shutil.copyfile(path, os.path.join(tmp, f"{stem}.mp3"))
+        os.rename(tmp, _entry_dir(key))
+    except OSError:
+        # Lost the race (or copy failed): the existing entry stays authoritative
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict()
+
+
+def materialize(cached, out_dir, timestamp):
+    """
+    Exposes cached stems as `<out_dir>/<Stem>_<timestamp>.mp3`, the layout the
+    Spectral Lab discovers. Hard links when possible, copies otherwise.
+    Returns {stem: path}, or None if evict() removed the entry since lookup():
+    a miss, like lookup()'s, and nothing is left in `out_dir`.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = {}
+    try:
+        for stem, src in cached.items():
+            dst = os.path.join(out_dir, f"{stem}_{timestamp}.mp3")
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+            outputs[stem] = dst
+    except OSError:
+        for path in outputs.values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return None
+    return outputs
+
+
+def _acquire_lock(path):
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+        return False
+    os.close(fd)
+    return True
+
+
+def _dir_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+def evict(max_bytes=None):
+    """
+    Deletes least-recently-used entries until the cache fits in `max_bytes`.
+    Only one process evicts at a time; others skip. Entries are renamed out of
+    the way before deletion so readers never see a half-deleted entry.
+    """
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    lock = os.path.join(CACHE_DIR, ".evict.lock")
+    if not os.path.isdir(CACHE_DIR) or not _acquire_lock(lock):
+        return
+    try:
+        entries = []
+        total = 0
+        for name in os.listdir(CACHE_DIR):
+            path = os.path.join(CACHE_DIR, name)
+            if name.startswith("tmp-"):
+                # Leftovers of crashed writers
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_LOCK_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = _dir_size(path)
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            trash = os.path.join(CACHE_DIR, f"tmp-{uuid.uuid4().hex}")
+            try:
+                os.rename(path, trash)
+            except OSError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+    finally:
+        os.remove(lock)
@@ -0,0 +1,470 @@
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from analysis import SignalAnalysis
+from profiling import stage
+
+STEMS = ['Vocals', 'Drums', 'Bass', 'Other']
+MODEL_SR = 44100
+
+# Paper §3.4: fixed-length chunks keep peak memory independent of song length
+CHUNK_SECONDS = 10.0
+OVERLAP_SECONDS = 1.0
+
+# STFT feeding StemMixer
+N_FFT = 4096
+HOP_LENGTH = 1024
+
+WEIGHTS_DIR = os.environ.get("SPECTACLES_WEIGHTS_DIR", "weights")
+# Plain state-dict copies of the Demucs and MDX weights, memory-mapped by every process
+MMAP_DIR = os.environ.get("SPECTACLES_MMAP_DIR", os.path.join(".cache", "weights"))
+
+
+def map_weights(module, name):
+    """
+    Re-binds `module`'s parameters and buffers to a memory-mapped copy of its
+    state dict at <MMAP_DIR>/<name>.pt, written on first use. The mapping is
+    copy-on-write over the page cache, so every process loading the same model
+    shares one physical copy of the weights; the tensors it was loaded with
+    are freed. Returns the module as loaded if the copy cannot be written.
+    """
+    import torch
+
+    path = os.path.join(MMAP_DIR, name + ".pt")
+    try:
+        if not os.path.exists(path):
+            os.makedirs(MMAP_DIR, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=MMAP_DIR, prefix=name + ".", suffix=".part")
+            os.close(fd)
+            try:
+                torch.save(module.state_dict(), tmp)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except OSError:
+        return module
+    module.load_state_dict(state, assign=True)
+    return module
+
+
+def load_mixer(weights_dir=WEIGHTS_DIR, backend="torch"):
+    if backend != "torch":
+        from onnx_backend import load_onnx_mixer
+        return load_onnx_mixer(weights_dir, int8=backend == "onnx-int8")
+
+    import torch
+    from models import StemMixer
+
+    # mmap + assign: the parameters stay backed by the (copy-on-write) mapped
+    # file, so every worker process shares the same page-cache pages
+    state = torch.load(os.path.join(weights_dir, "stem_mixer.pth"), map_location="cpu",
+                       mmap=True, weights_only=True)
+    mixer = StemMixer()
+    mixer.load_state_dict(state, assign=True)
+    return mixer.eval()
+
+
+def load_mdx(weights_dir=WEIGHTS_DIR, backend="torch"):
+    if backend != "torch":
+        from onnx_backend import load_onnx_mdx
+        return load_onnx_mdx(weights_dir, int8=backend == "onnx-int8")
+
+    import torch
+
+    path = os.path.join(weights_dir, "mdx.pt")
+    st = os.stat(path)
+    m_model = torch.jit.load(path, map_location="cpu")
+    return map_weights(m_model, f"mdx-{st.st_size}-{st.st_mtime_ns}").eval()
+
+
+def load_demucs(demucs_name="htdemucs"):
+    import demucs
+    from demucs.pretrained import get_model
+
+    return map_weights(get_model(demucs_name), f"demucs-{demucs_name}-{demucs.__version__}").eval()
+
+
+def load_models(weights_dir=WEIGHTS_DIR, demucs_name="htdemucs", backend="torch"):
+    """
+    Loads the three networks of the pipeline on CPU.
+    - StemMixer: state dict at <weights_dir>/stem_mixer.pth
+    - MDX: TorchScript module at <weights_dir>/mdx.pt, (B, 2, T) -> (B, 4, 2, T) in STEMS order
+    - Demucs: the pretrained `demucs_name` bag from the demucs package
+    All three are memory-mapped (see map_weights), so worker processes share
+    their weights.
+    `backend` is "torch", "onnx" or "onnx-int8"; the ONNX backends run StemMixer
+    and MDX on ONNX Runtime, exporting them from the torch weights on first use.
+    Returns (mixer, d_model, m_model). Every call loads afresh; use
+    model_registry.get_models for the per-process shared copy.
+    """
+    from onnx_backend import BACKENDS
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (expected one of {BACKENDS})")
+    return load_mixer(weights_dir, backend), load_demucs(demucs_name), load_mdx(weights_dir, backend)
+
+
+# ==========================================
+# LAZY DECODE
+# ==========================================
+def _to_stereo(block):
+    if block.shape[1] == 1:
+        return np.repeat(block, 2, axis=1)
+    return block[:, :2]
+
+
+def decode_blocks(input_path, block_frames=MODEL_SR):
+    """
+    Decodes `input_path` block by block to stereo float32 at MODEL_SR.
+    Yields arrays of shape (2, n).
+    """
+    import soxr
+
+    with sf.SoundFile(input_path) as f:
+        resampler = None
+        if f.samplerate != MODEL_SR:
+            resampler = soxr.ResampleStream(f.samplerate, MODEL_SR, 2, dtype='float32')
+        while True:
+            block = f.read(block_frames, dtype='float32', always_2d=True)
+            last = len(block) < block_frames
+            block = _to_stereo(block)
+            if resampler is not None:
+                block = resampler.resample_chunk(block, last=last)
+            if len(block):
+                yield np.ascontiguousarray(block.T)
+            if last:
+                break
+
+
+def read_chunks(input_path, chunk_len, overlap):
+    """
+    Splits the lazily decoded input into chunks of `chunk_len` samples where
+    consecutive chunks share `overlap` samples.
+    Yields (start_sample, chunk) with chunk shape (2, <=chunk_len).
+    """
+    hop = chunk_len - overlap
+    buf = np.zeros((2, 0), dtype=np.float32)
+    start = 0
+    blocks = decode_blocks(input_path)
+    while True:
+        with stage("decode"):
+            block = next(blocks, None)
+        if block is None:
+            break
+        buf = np.concatenate([buf, block], axis=1)
+        while buf.shape[1] >= chunk_len:
+            yield start, buf[:, :chunk_len]
+            buf = buf[:, hop:]
+            start += hop
+    # Remainder: only if it holds samples not already covered by the last chunk
+    if buf.shape[1] > (overlap if start else 0):
+        yield start, buf
+
+
+def count_chunks(input_path, chunk_len, overlap):
+    info = sf.info(input_path)
+    n_samples = int(info.frames * MODEL_SR / info.samplerate)
+    return max(1, math.ceil(max(n_samples - overlap, 1) / (chunk_len - overlap)))
+
+
+# ==========================================
+# MODEL STAGES
+# ==========================================
+@stage("demucs")
+def run_demucs(d_model, chunk):
+    """Demucs branch: (2, T) numpy -> (4, 2, T) tensor in STEMS order."""
+    import torch
+    from demucs.apply import apply_model
+
+    with torch.inference_mode():
+        out = apply_model(d_model, torch.from_numpy(chunk)[None], shifts=0, split=True,
+                          overlap=0.25, progress=False)[0]
+    order = [d_model.sources.index(stem.lower()) for stem in STEMS]
+    return out[order]
+
+
+@stage("mdx")
+def run_mdx(m_model, chunk):
+    """MDX branch: (2, T) numpy -> (4, 2, T) tensor in STEMS order."""
+    import torch
+
+    with torch.inference_mode():
+        return m_model(torch.from_numpy(chunk)[None])[0]
+
+
+@stage("stem_mixer")
+def run_mixer(mixer, d_out, m_out):
+    """
+    StemMixer blend (paper §3.1): |Y| = α·|Demucs| + (1−α)·|MDX|,
+    reconstructed with the Demucs phase.
+    d_out, m_out: (4, 2, T) tensors or arrays. Returns a (4, 2, T) numpy array.
+    """
+    import torch
+
+    d = SignalAnalysis(torch.as_tensor(d_out), MODEL_SR, N_FFT, HOP_LENGTH)
+    m = SignalAnalysis(torch.as_tensor(m_out), MODEL_SR, N_FFT, HOP_LENGTH)
+    with torch.inference_mode():
+        alpha = mixer(torch.cat([d.magnitude, m.magnitude], dim=1))
+        Y = torch.polar(alpha * d.magnitude + (1 - alpha) * m.magnitude, d.phase)
+        return d.istft(Y).numpy()
+
+
+def pad_chunk(chunk):
+    """Pads short (tail) chunks to one STFT frame so every stage accepts them."""
+    n = chunk.shape[1]
+    if n < N_FFT:
+        chunk = np.pad(chunk, ((0, 0), (0, N_FFT - n)))
+    return chunk
+
+
+def mix_chunk(mixer, d_out, m_out, n):
+    """
+    StemMixer stage plus the paper's post-processing: trims the padding and
+    clips the summed outputs to avoid digital clipping.
+    Returns (4, 2, n) float32 stems.
+    """
+    stems = run_mixer(mixer, d_out, m_out)[..., :n]
+    return np.clip(stems, -1.0, 1.0).astype(np.float32)
+
+
+def separate_chunk(chunk, mixer, d_model, m_model):
+    """
+    Runs Demucs, MDX and StemMixer over one (2, T) chunk.
+    Returns (4, 2, T) float32 stems.
+    """
+    padded = pad_chunk(chunk)
+    return mix_chunk(mixer, run_demucs(d_model, padded), run_mdx(m_model, padded), chunk.shape[1])
+
+
+# ==========================================
+# OUT-OF-MEMORY FALLBACK
+# ==========================================
+def is_out_of_memory(error):
+    """True for a failed allocation: MemoryError, or the RuntimeError of torch's CPU allocator."""
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error)
+    return isinstance(error, RuntimeError) and ("DefaultCPUAllocator" in message or "out of memory" in message)
+
+
+def piece_bounds(n, pieces, overlap):
+    """(start, end) of `pieces` sub-chunks covering n samples, consecutive ones sharing `overlap`."""
+    length = -(-(n + (pieces - 1) * overlap) // pieces)
+    hop = length - overlap
+    return [(i * hop, min(i * hop + length, n)) for i in range(pieces)]
+
+
+def max_pieces(n, overlap):
+    """Most pieces a chunk of n samples splits into while every piece stays longer than twice the overlap."""
+    min_len = max(2 * overlap, N_FFT)
+    return max(1, (n - overlap) // (min_len - overlap))
+
+
+def separate_pieces(runner, mixer, chunk, overlap, pieces):
+    """
+    Separates a (2, n) chunk as `pieces` shorter sub-chunks, one at a time,
+    crossfaded over `overlap` samples like consecutive chunks. The number of
+    pieces doubles on every failed allocation until max_pieces is reached.
+    Returns ((4, 2, n) float32 stems, pieces used).
+    """
+    n = chunk.shape[1]
+    ramp = fade_in(overlap)
+    pieces = min(pieces, max_pieces(n, overlap))
+    while True:
+        try:
+            stems = np.empty((len(STEMS), 2, n), dtype=np.float32)
+            for i, (a, b) in enumerate(piece_bounds(n, pieces, overlap)):
+                d_out, m_out = runner.result(runner.submit(pad_chunk(chunk[:, a:b])))
+                out = mix_chunk(mixer, d_out, m_out, b - a)
+                k = min(overlap, b - a) if i else 0
+                stems[..., a:a + k] = stems[..., a:a + k] * (1 - ramp[:k]) + out[..., :k] * ramp[:k]
+                stems[..., a + k:b] = out[..., k:]
+            return stems, pieces
+        except Exception as e:
+            if not is_out_of_memory(e) or pieces >= max_pieces(n, overlap):
+                raise
+        d_out = m_out = stems = None
+        pieces = min(2 * pieces, max_pieces(n, overlap))
+
+
+# ==========================================
+# OVERLAP-ADD STREAMING WRITER
+# ==========================================
+def fade_in(overlap):
+    """Linear crossfade ramp over `overlap` samples (the fade-out is 1 - ramp)."""
+    return ((np.arange(overlap) + 0.5) / max(overlap, 1)).astype(np.float32)
+
+
+class StemWriter:
+    """
+    Crossfades consecutive chunks over their shared samples and streams the
+    settled part of every stem to disk. Files are written as `<path>.part`
+    and renamed once complete.
+    """
+
+    def __init__(self, paths, overlap, samplerate=MODEL_SR):
+        self.paths = paths
+        self.overlap = overlap
+        self.fade_in = fade_in(overlap)
+        self.tail = None
+        self.files = [sf.SoundFile(p + ".part", 'w', samplerate, 2, format='MP3')
+                      for p in paths]
+
+    def push(self, stems, final=False):
+        if self.tail is not None:
+            n = min(self.tail.shape[-1], stems.shape[-1])
+            stems = stems.copy()
+            fade = self.fade_in[:n]
+            stems[..., :n] = self.tail[..., :n] * (1 - fade) + stems[..., :n] * fade
+            self.tail = None
+        if final or self.overlap == 0:
+            self._write(stems)
+        else:
+            self._write(stems[..., :-self.overlap])
+            self.tail = stems[..., -self.overlap:]
+
+    @stage("encode")
+    def _write(self, stems):
+        for f, stem in zip(self.files, stems):
+            f.write(stem.T)
+
+    def close(self):
+        if self.tail is not None:
+            self._write(self.tail)
+            self.tail = None
+        for f in self.files:
+            f.close()
+        for p in self.paths:
+            os.replace(p + ".part", p)
+
+    def abort(self):
+        for f in self.files:
+            f.close()
+        for p in self.paths:
+            if os.path.exists(p + ".part"):
+                os.remove(p + ".part")
+
+
+# ==========================================
+# ENGINE
+# ==========================================
+def stream_separation(input_path, mixer, d_model, m_model, out_dir=".",
+                      chunk_seconds=CHUNK_SECONDS, overlap_seconds=OVERLAP_SECONDS, timestamp=None,
+                      mode="serial", branch_threads=(None, None), weights_dir=WEIGHTS_DIR,
+                      backend="torch", model_id=None, memory_budget_mb=None):
+    """
+    Chunked streaming separation.
+    Decodes the input lazily, separates it chunk by chunk and streams the
+    crossfaded stems to `<out_dir>/<Stem>_<timestamp>.mp3`, so peak memory is
+    bounded by the chunk size rather than the song length.
+
+    `mode` selects how the Demucs and MDX branches run (see branches.BranchRunner).
+    In "thread"/"process" mode chunk N+1's branches run while chunk N is mixed
+    and encoded; process workers load their branch with `backend`.
+
+    Passing `model_id` (see result_cache.model_id) enables the result cache: a
+    repeat of the same audio with the same models skips inference entirely.
+
+    `memory_budget_mb` replaces chunk_seconds/overlap_seconds with the largest
+    chunk that fits the budget (see memory_plan.plan). Whatever the chunk size,
+    a chunk whose allocation fails is retried as smaller pieces and the
+    following chunks keep that split ("pieces" in the progress dicts).
+    Yields progress dicts; the last one has stage "done" and the output paths.
+    """
+    from branches import BranchRunner
+
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    outputs = {stem: os.path.join(out_dir, f"{stem}_{timestamp}.mp3") for stem in STEMS}
+
+    cache_key = None
+    if model_id is not None:
+        import result_cache
+
+        # A budgeted run is keyed on the budget, not on the chunk size planned
+        # from it: that depends on how much memory happens to be resident
+        chunking = ({"memory_budget_mb": memory_budget_mb} if memory_budget_mb is not None
+                    else {"chunk_seconds": chunk_seconds, "overlap_seconds": overlap_seconds})
+        cache_key = result_cache.result_key(input_path, model_id, **chunking)
+        cached = result_cache.lookup(cache_key, STEMS)
+        # An entry evicted after lookup() fails to materialize: separate as on a miss
+        cached = result_cache.materialize(cached, out_dir, timestamp) if cached is not None else None
+        if cached is not None:
+            yield {"stage": "done", "done": 0, "total": 0, "fraction": 1.0, "outputs": cached,
+                   "cached": True}
+            return
+
+    if memory_budget_mb is not None:
+        import memory_plan
+
+        plan = memory_plan.plan(memory_budget_mb, mode=mode)
+        chunk_seconds, overlap_seconds = plan["chunk_seconds"], plan["overlap_seconds"]
+
+    chunk_len = int(chunk_seconds * MODEL_SR)
+    overlap = int(overlap_seconds * MODEL_SR)
+
+    total = count_chunks(input_path, chunk_len, overlap)
+
+    os.makedirs(out_dir, exist_ok=True)
+    writer = StemWriter([outputs[stem] for stem in STEMS], overlap)
+    try:
+        with BranchRunner(d_model, m_model, mode=mode, branch_threads=branch_threads,
+                          weights_dir=weights_dir, backend=backend) as runner:
+            chunks = read_chunks(input_path, chunk_len, overlap)
+            current = next(chunks, None)
+            pending = runner.submit(pad_chunk(current[1])) if current is not None else None
+            done = 0
+            pieces = 1
+            while current is not None:
+                upcoming = next(chunks, None)
+                # Queue the next chunk's base models before mixing this one
+                upcoming_pending = None
+                if upcoming is not None and pieces == 1:
+                    upcoming_pending = runner.submit(pad_chunk(upcoming[1]))
+                stems = None
+                if pending is not None:
+                    try:
+                        d_out, m_out = runner.result(pending)
+                        stems = mix_chunk(mixer, d_out, m_out, current[1].shape[1])
+                    except Exception as e:
+                        if not is_out_of_memory(e):
+                            raise
+                        # From here on every chunk runs as smaller pieces, without prefetching
+                        d_out = m_out = None
+                        runner.discard(upcoming_pending)
+                        upcoming_pending, pieces = None, 2
+                if stems is None:
+                    stems, pieces = separate_pieces(runner, mixer, current[1], overlap, pieces)
+                writer.push(stems, final=upcoming is None)
+                done += 1
+                yield {"stage": "chunk", "done": done, "total": max(total, done),
+                       "fraction": min(done / total, 1.0), "pieces": pieces}
+                current, pending = upcoming, upcoming_pending
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    if cache_key is not None:
+        result_cache.store(cache_key, outputs)
+    yield {"stage": "done", "done": done, "total": done, "fraction": 1.0, "outputs": outputs,
+           "cached": False}
+
+
+def separate_audio(input_path, mixer, d_model, m_model, out_dir=".", progress=None, **kwargs):
+    """
+    Runs stream_separation to completion.
+    `progress(fraction, text)` is called after every chunk (e.g. a st.progress bar's .progress).
+    Returns {stem: output path}.
+    """
+    outputs = None
+    for event in stream_separation(input_path, mixer, d_model, m_model, out_dir=out_dir, **kwargs):
+        if progress is not None:
+            progress(event["fraction"], text=f"Separating chunk {event['done']}/{event['total']}")
+        outputs = event.get("outputs", outputs)
+    return outputs
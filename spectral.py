@@ -0,0 +1,217 @@
+import numpy as np
+
+
+# Frames per block of the streaming transforms: bounds their working memory
+FRAMES_PER_BLOCK = 256
+
+
+class FrameStream:
+    """
+    Cuts consecutive sample blocks (..., m) pushed with feed() into frames of
+    `n_fft` samples every `hop`; only the tail the next frame still needs is
+    carried between blocks. With `center` the signal is zero-padded by
+    n_fft // 2 at both ends, as librosa.stft does.
+    """
+
+    def __init__(self, n_fft, hop, center=False):
+        self.n_fft = n_fft
+        self.hop = hop
+        self.pad = n_fft // 2 if center else 0
+        self.carry = None
+
+    def _cut(self, buf):
+        n = 1 + (buf.shape[-1] - self.n_fft) // self.hop if buf.shape[-1] >= self.n_fft else 0
+        self.carry = buf[..., n * self.hop:]
+        if not n:
+            return np.zeros(buf.shape[:-1] + (0, self.n_fft), dtype=buf.dtype)
+        return np.lib.stride_tricks.sliding_window_view(buf, self.n_fft, axis=-1)[..., ::self.hop, :][..., :n, :]
+
+    def feed(self, block):
+        """(..., n_frames, n_fft) view of the frames completed by `block`."""
+        block = np.asarray(block)
+        if self.carry is None:
+            self.carry = np.zeros(block.shape[:-1] + (self.pad,), dtype=block.dtype)
+        return self._cut(np.concatenate([self.carry, block], axis=-1))
+
+    def close(self):
+        """The frames of the end padding (none without `center`)."""
+        if not self.pad or self.carry is None:
+            return None
+        return self._cut(np.concatenate([self.carry, np.zeros(self.carry.shape[:-1] + (self.pad,),
+                                                              dtype=self.carry.dtype)], axis=-1))
+
+
+def frames(blocks, n_fft, hop, center=False):
+    """Generator form of FrameStream: (..., n_frames, n_fft) views for a stream of blocks."""
+    stream = FrameStream(n_fft, hop, center)
+    for block in blocks:
+        yield stream.feed(block)
+    tail = stream.close()
+    if tail is not None:
+        yield tail
+
+
+def log_bins(freqs, power, n_bins=512, fmin=20.0, fmax=None):
+    """
+    Re-bins a linear-frequency spectrum onto `n_bins` log-spaced bands.
+    Each band is the mean of the linear bins it covers; bands narrower than the
+    FFT resolution are interpolated instead. `power` may hold several spectra
+    (..., n_freqs); they are re-binned together.
+    """
+    fmax = freqs[-1] if fmax is None else min(fmax, freqs[-1])
+    edges = np.geomspace(fmin, fmax, n_bins + 1)
+    centers = np.sqrt(edges[:-1] * edges[1:])
+
+    idx = np.searchsorted(freqs, edges)
+    counts = np.diff(idx)
+    csum = np.concatenate([np.zeros(power.shape[:-1] + (1,)), np.cumsum(power, axis=-1)], axis=-1)
+    sums = csum[..., idx[1:]] - csum[..., idx[:-1]]
+
+    # np.interp, with the weights shared by every spectrum
+    j = np.clip(np.searchsorted(freqs, centers) - 1, 0, len(freqs) - 2)
+    w = np.clip((centers - freqs[j]) / (freqs[j + 1] - freqs[j]), 0.0, 1.0)
+    out = power[..., j] * (1 - w) + power[..., j + 1] * w
+    has_bins = counts > 0
+    out[..., has_bins] = sums[..., has_bins] / counts[has_bins]
+    return centers, out
+
+
+def psd_db(power_sum, n_frames, window, sr, n_bins=512, fmin=20.0):
+    """
+    Welch average of `n_frames` windowed frame powers summed in `power_sum`
+    (..., n_fft // 2 + 1), with one-sided density scaling (same convention as
+    scipy.signal.welch). Returns (log-spaced frequencies, PSD in dB (..., n_bins)).
+    """
+    freqs = np.fft.rfftfreq(len(window), 1 / sr)
+    psd = np.zeros(len(freqs)) + power_sum / (max(n_frames, 1) * sr * np.sum(window.astype(np.float64) ** 2))
+    psd[..., 1:-1] *= 2
+    freqs_log, psd_log = log_bins(freqs, psd, n_bins=n_bins, fmin=fmin)
+    return freqs_log, 10 * np.log10(psd_log + 1e-12)
+
+
+class WelchPSD:
+    """
+    Streaming Welch PSD: the power of the Hann-windowed, overlapping frames of
+    the blocks pushed with feed() is accumulated, so memory stays constant
+    regardless of the signal length. Blocks may hold several signals
+    (..., m); each gets its own PSD.
+    """
+
+    def __init__(self, sr, n_fft=4096, overlap=0.5):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.window = np.hanning(n_fft).astype(np.float32)
+        self.frames = FrameStream(n_fft, int(n_fft * (1 - overlap)))
+        self.power_sum = 0.0
+        self.n_frames = 0
+
+    def feed(self, block):
+        f = self.frames.feed(block)
+        spec = np.fft.rfft(f * self.window, axis=-1)
+        self.power_sum = self.power_sum + np.sum(spec.real ** 2 + spec.imag ** 2, axis=-2)
+        self.n_frames += f.shape[-2]
+
+    def result(self, n_bins=512, fmin=20.0):
+        """(log-spaced frequencies, PSD in dB (..., n_bins))."""
+        return psd_db(self.power_sum, self.n_frames, self.window, self.sr, n_bins, fmin)
+
+
+def welch_from_blocks(blocks, sr, n_fft=4096, overlap=0.5, n_bins=512, fmin=20.0):
+    """
+    Welch PSD of a stream of sample blocks (see WelchPSD).
+    Returns (log-spaced frequencies, PSD in dB (..., n_bins)).
+    """
+    welch = WelchPSD(sr, n_fft, overlap)
+    for block in blocks:
+        welch.feed(block)
+    return welch.result(n_bins, fmin)
+
+
+def welch_psd(audio_path, n_fft=4096, overlap=0.5, blocks_per_read=64, n_bins=512, fmin=20.0,
+              start=None, end=None):
+    """
+    Streaming Welch PSD of an audio file (or stem container track) at its
+    native sample rate, over the whole track or its [start, end] seconds window.
+    The file is read `blocks_per_read` hops at a time (see welch_from_blocks).
+    Returns (log-spaced frequencies, PSD in dB).
+    """
+    import stem_container
+
+    hop = int(n_fft * (1 - overlap))
+    sr = stem_container.info(audio_path)[0]
+    blocks = stem_container.blocks(audio_path, blocks_per_read * hop, start, end, mono=True)
+    return welch_from_blocks(blocks, sr, n_fft, overlap, n_bins, fmin)
+
+
+class MelSpectrogram:
+    """
+    Streaming Mel-Spectrogram with the centred frames of SignalAnalysis /
+    librosa.stft: every block pushed with feed() is transformed on its own and
+    only the (..., n_mels, n_frames) mel power is kept. Blocks may hold
+    several signals (..., m); `mel_rows` limits the mel power to some of them
+    (index into the leading axis; None for all).
+
+    The same frame power also feeds a Welch PSD (see psd()), so a signal's
+    spectrogram and PSD share one STFT: the frames that lie wholly inside the
+    signal, clear of the centring pad, are averaged at the analysis hop (75%
+    overlap for hop_length = n_fft // 4).
+    """
+
+    def __init__(self, sr, n_fft, hop_length, n_mels=128, fmax=None, mel_rows=None):
+        import librosa
+        import scipy.signal
+
+        self.sr = sr
+        self.window = scipy.signal.get_window("hann", n_fft).astype(np.float32)
+        self.basis = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmax=fmax)
+        self.frames = FrameStream(n_fft, hop_length, center=True)
+        self.mel_rows = mel_rows
+        self.parts = []
+        # Leading frames that still overlap the centring pad
+        self.pad_frames = -(-self.frames.pad // hop_length)
+        self.n_seen = 0
+        self.power_sum = 0.0
+        self.n_inside = 0
+
+    def _add(self, f, tail=False):
+        spec = np.fft.rfft(f * self.window, axis=-1)
+        power = spec.real ** 2 + spec.imag ** 2
+        if not tail:
+            # The frames cut at close() always reach into the end padding
+            skip = min(max(self.pad_frames - self.n_seen, 0), power.shape[-2])
+            self.power_sum = self.power_sum + np.sum(power[..., skip:, :], axis=-2)
+            self.n_inside += power.shape[-2] - skip
+            self.n_seen += power.shape[-2]
+        if self.mel_rows is not None:
+            if not len(self.mel_rows):
+                return
+            power = power[self.mel_rows]
+        self.parts.append(np.swapaxes(power @ self.basis.T, -1, -2))
+
+    def feed(self, block):
+        self._add(self.frames.feed(block))
+
+    def _close(self):
+        tail = self.frames.close()
+        if tail is not None:
+            self._add(tail, tail=True)
+            self.frames.carry = None
+
+    def result(self):
+        """Mel power in dB relative to each signal's maximum (analysis.to_db)."""
+        from analysis import to_db
+
+        self._close()
+        return to_db(np.concatenate(self.parts, axis=-1))
+
+    def psd(self, n_bins=512, fmin=20.0):
+        """(log-spaced frequencies, Welch PSD in dB (..., n_bins)) of every signal fed."""
+        return psd_db(self.power_sum, self.n_inside, self.window, self.sr, n_bins, fmin)
+
+
+def mel_db_from_blocks(blocks, sr, n_fft, hop_length, n_mels=128, fmax=None):
+    """Mel-Spectrogram in dB of a stream of sample blocks (see MelSpectrogram)."""
+    mel = MelSpectrogram(sr, n_fft, hop_length, n_mels, fmax)
+    for block in blocks:
+        mel.feed(block)
+    return mel.result()
@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+import feature_cache as cache
+
+# Frames per stored tile and dB range mapped onto uint8 (power_to_db top_db=80)
+TILE_FRAMES = 256
+DB_FLOOR = -80.0
+
+
+def quantize(S_dB, db_floor=DB_FLOOR):
+    """Maps [db_floor, 0] dB onto [0, 255]."""
+    q = np.clip((S_dB - db_floor) / -db_floor, 0.0, 1.0) * 255
+    return np.round(q).astype(np.uint8)
+
+
+def dequantize(q, db_floor=DB_FLOOR):
+    return q.astype(np.float32) / 255 * -db_floor + db_floor
+
+
+def _downsample(q):
+    """Halves the time resolution with a max-pool, so transients stay visible."""
+    if q.shape[1] % 2:
+        q = np.concatenate([q, q[:, -1:]], axis=1)
+    return np.maximum(q[:, 0::2], q[:, 1::2])
+
+
+def _levels(S_dB, tile_frames):
+    levels = [quantize(S_dB)]
+    while levels[-1].shape[1] > tile_frames:
+        levels.append(_downsample(levels[-1]))
+    return levels
+
+
+def _tile_key(audio_path, params, level, index, tile_frames):
+    return cache.cache_key(audio_path, "mel_tile", level=level, index=index,
+                           tile_frames=tile_frames, **params)
+
+
+def _meta_key(audio_path, params, tile_frames):
+    return cache.cache_key(audio_path, "mel_pyramid", tile_frames=tile_frames, **params)
+
+
+def build_pyramid(audio_path, S_dB, params, tile_frames=TILE_FRAMES):
+    """
+    Quantizes a mel dB matrix and stores it as tiles at successively halved
+    time resolutions, until one tile covers the whole track.
+    Returns the number of frames at each level.
+    """
+    levels = _levels(S_dB, tile_frames)
+    for level, q in enumerate(levels):
+        for index in range(math.ceil(q.shape[1] / tile_frames)):
+            tile = q[:, index * tile_frames:(index + 1) * tile_frames]
+            cache.save_array(_tile_key(audio_path, params, level, index, tile_frames), tile)
+
+    # Written last: its presence means every tile was stored
+    frames = np.array([q.shape[1] for q in levels])
+    cache.save_arrays(_meta_key(audio_path, params, tile_frames), frames=frames)
+    return frames
+
+
+def pyramid_frames(audio_path, params, compute_mel, tile_frames=TILE_FRAMES):
+    """
+    Returns the per-level frame counts, building the pyramid on a miss.
+    `compute_mel()` is only called when the pyramid has to be built.
+    """
+    meta = cache.load_arrays(_meta_key(audio_path, params, tile_frames))
+    if meta is not None:
+        return meta["frames"]
+    return build_pyramid(audio_path, compute_mel(), params, tile_frames)
+
+
+def is_built(audio_path, params, tile_frames=TILE_FRAMES):
+    """True if the pyramid for these parameters is complete in the cache."""
+    return cache.load_arrays(_meta_key(audio_path, params, tile_frames)) is not None
+
+
+def reduce(S_dB, max_cols):
+    """
+    Quantizes a dB matrix and max-pools it until it fits `max_cols` columns,
+    like one pyramid level. Returns (uint8 matrix, level).
+    """
+    q, level = quantize(S_dB), 0
+    while q.shape[1] > max_cols:
+        q, level = _downsample(q), level + 1
+    return q, level
+
+
+def choose_level(n_frames, max_cols, n_levels):
+    """Coarsest-needed level: the finest one showing the window in <= max_cols columns."""
+    level = 0
+    while level < n_levels - 1 and math.ceil(n_frames / 2 ** level) > max_cols:
+        level += 1
+    return level
+
+
+def load_window(audio_path, params, compute_mel, start_frame, end_frame, max_cols,
+                tile_frames=TILE_FRAMES):
+    """
+    Loads the quantized spectrogram for frames [start_frame, end_frame) at the
+    resolution that fits `max_cols` columns, touching only the tiles it overlaps.
+    Returns (uint8 matrix, level, first level-0 frame of the first column).
+    """
+    frames = pyramid_frames(audio_path, params, compute_mel, tile_frames)
+    start_frame = max(0, min(int(start_frame), int(frames[0]) - 1))
+    end_frame = max(start_frame + 1, min(int(end_frame), int(frames[0])))
+    level = choose_level(end_frame - start_frame, max_cols, len(frames))
+
+    scale = 2 ** level
+    col_lo = start_frame // scale
+    col_hi = min(math.ceil(end_frame / scale), int(frames[level]))
+    tiles = []
+    for index in range(col_lo // tile_frames, (col_hi - 1) // tile_frames + 1):
+        tile = cache.load_array(_tile_key(audio_path, params, level, index, tile_frames))
+        if tile is None:
+            # A tile was evicted: rebuild the pyramid and slice it in memory
+            S_dB = compute_mel()
+            build_pyramid(audio_path, S_dB, params, tile_frames)
+            q = _levels(S_dB, tile_frames)[level][:, col_lo:col_hi]
+            return q, level, col_lo * scale
+        tiles.append(tile)
+
+    offset = (col_lo // tile_frames) * tile_frames
+    q = np.concatenate(tiles, axis=1)[:, col_lo - offset:col_hi - offset]
+    return q, level, col_lo * scale
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+# Layout: MAGIC | uint32 header length | JSON header | zero padding | samples.
+# Samples are (frames, tracks, channels), time-major, so any time range of
+# any track is a strided view of one contiguous block of the file.
+MAGIC = b"SPECSTEM"
+ALIGN = 64
+DTYPES = ("int16", "float16")
+CACHE_DIR = os.environ.get("SPECTACLES_STEMS_DIR", os.path.join(".cache", "stems"))
+
+# "<container>#<track>" names one track of a container wherever a file path is accepted
+REF_SEP = "#"
+
+
+def make_ref(path, track):
+    return f"{path}{REF_SEP}{track}"
+
+
+def parse_ref(ref):
+    """Returns (path, track) for a track reference, (path, None) for a plain file."""
+    path, sep, track = ref.rpartition(REF_SEP)
+    if sep and path.endswith(".stems"):
+        return path, track
+    return ref, None
+
+
+# ==========================================
+# WRITING
+# ==========================================
+def _read_source(path, samplerate):
+    y, sr = sf.read(path, dtype="float32", always_2d=True)
+    if sr != samplerate:
+        import soxr
+        y = soxr.resample(y, sr, samplerate)
+    return y
+
+
+def pack(path, sources, samplerate=None, channels=2, dtype="int16"):
+    """
+    Decodes `sources` ({track name: audio file}) once and writes them as one
+    aligned container at `path`. Tracks are resampled to `samplerate` (default:
+    the highest source rate), up/down-mixed to `channels` and zero-padded to
+    the longest track; their own durations are kept in the header.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {DTYPES}")
+    infos = {name: sf.info(src) for name, src in sources.items()}
+    samplerate = samplerate or max(info.samplerate for info in infos.values())
+    lengths = {name: int(round(info.frames * samplerate / info.samplerate)) for name, info in infos.items()}
+    frames = max(lengths.values(), default=0)
+
+    header = {
+        "version": 1,
+        "samplerate": samplerate,
+        "channels": channels,
+        "dtype": dtype,
+        "frames": frames,
+        "tracks": list(sources),
+        "durations": {name: n / samplerate for name, n in lengths.items()},
+    }
+    header_bytes = json.dumps(header).encode()
+    offset = -(-(len(MAGIC) + 4 + len(header_bytes)) // ALIGN) * ALIGN
+
+    # A temp file of our own: concurrent packers of the same container each
+    # write theirs and the last rename wins, never exposing a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                               suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + np.uint32(len(header_bytes)).tobytes() + header_bytes)
+            f.write(b"\0" * (offset - f.tell()))
+        data = np.memmap(tmp, dtype=dtype, mode="r+", offset=offset,
+                         shape=(frames, len(sources), channels))
+        for i, (name, src) in enumerate(sources.items()):
+            y = _read_source(src, samplerate)[:frames]
+            if y.shape[1] != channels:
+                y = np.repeat(y.mean(axis=1, keepdims=True), channels, axis=1)
+            if dtype == "int16":
+                y = np.round(np.clip(y, -1.0, 32767 / 32768) * 32768)
+            data[:len(y), i] = y
+        data.flush()
+        del data
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+def packed(sources, dtype="int16"):
+    """
+    Container of `sources` in the content-addressed stems cache, packed on
+    first use. Changed sources get a new container, so it is never stale.
+    """
+    import feature_cache
+
+    payload = json.dumps({"sources": {name: feature_cache.file_digest(src) for name, src in sources.items()},
+                          "dtype": dtype}, sort_keys=True)
+    path = os.path.join(CACHE_DIR, hashlib.sha1(payload.encode()).hexdigest() + ".stems")
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pack(path, sources, dtype=dtype)
+    return path
+
+
+# ==========================================
+# READING
+# ==========================================
+class StemContainer:
+    """
+    Memory-mapped view of a packed container. Slicing returns views into the
+    mapped file: only the pages of the requested time range are ever read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a stem container")
+            size = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+            self.header = json.loads(f.read(size))
+        offset = -(-(len(MAGIC) + 4 + size) // ALIGN) * ALIGN
+        h = self.header
+        self.samplerate = h["samplerate"]
+        self.tracks = h["tracks"]
+        self.data = np.memmap(path, dtype=h["dtype"], mode="r", offset=offset,
+                              shape=(h["frames"], len(self.tracks), h["channels"]))
+
+    def duration(self, track):
+        return self.header["durations"][track]
+
+    def _frames(self, start, end):
+        start = 0 if start is None else max(0, int(start * self.samplerate))
+        end = len(self.data) if end is None else min(len(self.data), int(np.ceil(end * self.samplerate)))
+        return start, max(start, end)
+
+    def slice(self, start=None, end=None):
+        """All tracks between `start` and `end` seconds: (frames, tracks, channels) view."""
+        a, b = self._frames(start, end)
+        return self.data[a:b]
+
+    def track(self, name, start=None, end=None):
+        """One track between `start` and `end` seconds: (frames, channels) view."""
+        return self.slice(start, end)[:, self.tracks.index(name)]
+
+    def to_float(self, x):
+        """float32 copy of a (slice of a) view, in [-1, 1)."""
+        x = np.asarray(x, dtype=np.float32)
+        return x / 32768 if self.header["dtype"] == "int16" else x
+
+
+_open = {}
+
+
+def open_container(path):
+    """Shared StemContainer per file (re-opened if the file changed)."""
+    st_ = os.stat(path)
+    key = (os.path.abspath(path), st_.st_mtime_ns)
+    if key not in _open:
+        _open[key] = StemContainer(path)
+    return _open[key]
+
+
+def info(ref):
+    """(samplerate, duration seconds) of a track reference or a plain audio file."""
+    path, track = parse_ref(ref)
+    if track is None:
+        i = sf.info(path)
+        return i.samplerate, i.duration
+    c = open_container(path)
+    return c.samplerate, c.duration(track)
+
+
+def read(ref, start=None, end=None, mono=False):
+    """
+    Float32 samples of a track reference or a plain audio file between
+    `start` and `end` seconds. Returns (samples, samplerate); samples are
+    (frames, channels), or (frames,) when `mono`.
+    """
+    path, track = parse_ref(ref)
+    if track is None:
+        sr = sf.info(path).samplerate
+        a = 0 if start is None else int(start * sr)
+        b = None if end is None else int(np.ceil(end * sr))
+        y, sr = sf.read(path, start=a, stop=b, dtype="float32", always_2d=True)
+    else:
+        c = open_container(path)
+        sr = c.samplerate
+        end = c.duration(track) if end is None else min(end, c.duration(track))
+        y = c.to_float(c.track(track, start, end))
+    return (y.mean(axis=1) if mono else y), sr
+
+
+def blocks(ref, blocksize, start=None, end=None, mono=False):
+    """
+    Streams a track reference or a plain audio file between `start` and `end`
+    seconds as consecutive float32 blocks of `blocksize` frames (the last may
+    be shorter), shaped like read(). Only one block is in memory at a time.
+    """
+    path, track = parse_ref(ref)
+    if track is None:
+        sr = sf.info(path).samplerate
+        a = 0 if start is None else int(start * sr)
+        b = None if end is None else int(np.ceil(end * sr))
+        source = sf.blocks(path, blocksize=blocksize, start=a, stop=b, dtype="float32", always_2d=True)
+    else:
+        c = open_container(path)
+        end = c.duration(track) if end is None else min(end, c.duration(track))
+        view = c.track(track, start, end)
+        source = (c.to_float(view[i:i + blocksize]) for i in range(0, len(view), blocksize))
+    for y in source:
+        yield y.mean(axis=1) if mono else y
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pack a mixture and its stems into one stem container.")
+    parser.add_argument("output", help="Container path (.stems)")
+    parser.add_argument("tracks", nargs="+", metavar="NAME=FILE", help="e.g. Mixture=song.mp3 Vocals=vocals.mp3")
+    parser.add_argument("--dtype", choices=DTYPES, default="int16")
+    parser.add_argument("--samplerate", type=int, default=None)
+    args = parser.parse_args()
+
+    pack(args.output, dict(t.split("=", 1) for t in args.tracks), args.samplerate, dtype=args.dtype)
+    c = StemContainer(args.output)
+    print(f"{args.output}: {len(c.tracks)} tracks, {c.samplerate} Hz, {len(c.data) / c.samplerate:.1f}s, "
+          f"{os.path.getsize(args.output) / 2 ** 20:.1f} MB")
+
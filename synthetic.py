@@ -0,0 +1,15 @@
+import numpy as np
+
+SYNTHETIC_SR = 44100
+
+
+def synthetic_signal(seconds, sr=SYNTHETIC_SR, seed=0):
+    """Deterministic stereo test signal: harmonic tones, a kick pattern and pink-ish noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    tones = sum(0.1 / k * np.sin(2 * np.pi * 220 * k * t) for k in range(1, 6))
+    kick = np.sin(2 * np.pi * 60 * t) * np.exp(-30 * (t % 0.5))
+    noise = np.cumsum(rng.standard_normal(len(t))) * 1e-3
+    noise -= np.convolve(noise, np.ones(256) / 256, mode="same")
+    y = (tones + 0.5 * kick + noise).astype(np.float32)
+    return np.stack([y, np.roll(y, 37)], axis=1) * 0.5
@@ -13,18 +13,14 @@ try:
     print("Initializing models...")
     mixer, d_model, m_model = load_models()
     
-    test_file = r"c:\Users\user\Downloads\JRoa - Byahe.mp3"
+    # Pass a track on the command line; defaults to the bundled demo mixture.
+    # For many tracks use batch_separate.py instead.
+    test_file = sys.argv[1] if len(sys.argv) > 1 else "temp_input.mp3"
     if not os.path.exists(test_file):
         print(f"Test file not found: {test_file}")
         sys.exit(1)
         
     print(f"Running separation on {test_file}...")
-    # Mocking streamlit functions since app.py uses them
-    import streamlit as st
-    class MockProgress:
-        def progress(self, *args, **kwargs): pass
-    st.progress = lambda x, text=None: MockProgress()
-    
     start_time = time.time()
     outputs = separate_audio(test_file, mixer, d_model, m_model)
     end_time = time.time()
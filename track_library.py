@@ -0,0 +1,376 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+import feature_cache
+import stem_container
+
+STEMS = ['Vocals', 'Drums', 'Bass', 'Other']
+LIBRARY_PATH = os.environ.get("SPECTACLES_LIBRARY", os.path.join(".cache", "library.sqlite"))
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a")
+
+# "Vocals_1765609752.mp3" (separation output) or "vocals.wav" (MUSDB layout)
+STEM_PATTERN = re.compile(r"^(vocals|drums|bass|other)(_[^.]*)?\.[^.]+$", re.IGNORECASE)
+MIXTURE_NAMES = ("mixture", "temp_input")
+MANIFEST_NAME = "manifest.jsonl"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    mixture TEXT,
+    duration REAL,
+    samplerate INTEGER,
+    channels INTEGER,
+    loudness_db REAL,
+    container TEXT,
+    added REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    track_id INTEGER NOT NULL REFERENCES tracks (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    duration REAL,
+    samplerate INTEGER,
+    channels INTEGER,
+    loudness_db REAL
+);
+CREATE INDEX IF NOT EXISTS files_track ON files (track_id);
+CREATE TABLE IF NOT EXISTS features (
+    path TEXT NOT NULL REFERENCES files (path) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    PRIMARY KEY (path, kind)
+);
+"""
+
+
+# ==========================================
+# FILE METADATA
+# ==========================================
+def loudness_db(audio_path, block_frames=1 << 16):
+    """RMS level of the whole file over all channels, in dBFS, streamed block by block."""
+    path, track = stem_container.parse_ref(audio_path)
+    if track is not None:
+        c = stem_container.open_container(path)
+        energy, count = 0.0, 0
+        for start in range(0, len(c.data), block_frames):
+            block = c.to_float(c.data[start:start + block_frames, c.tracks.index(track)])
+            energy += float(np.einsum("ij,ij->", block, block))
+            count += block.size
+    else:
+        energy, count = 0.0, 0
+        for block in sf.blocks(path, blocksize=block_frames, dtype="float32", always_2d=True):
+            energy += float(np.einsum("ij,ij->", block, block))
+            count += block.size
+    return 10 * np.log10(energy / count) if count and energy > 0 else None
+
+
+def file_metadata(audio_path):
+    """Header fields plus loudness and content digest of one audio file or container track."""
+    path, track = stem_container.parse_ref(audio_path)
+    if track is None:
+        info = sf.info(path)
+        samplerate, duration, channels = info.samplerate, info.duration, info.channels
+    else:
+        c = stem_container.open_container(path)
+        samplerate, duration, channels = c.samplerate, c.duration(track), c.header["channels"]
+    return {"duration": duration, "samplerate": samplerate, "channels": channels,
+            "loudness_db": loudness_db(audio_path), "digest": feature_cache.file_digest(audio_path)}
+
+
+def _stat(audio_path):
+    st_ = os.stat(stem_container.parse_ref(audio_path)[0])
+    return st_.st_size, st_.st_mtime_ns
+
+
+def _key(path):
+    container, track = stem_container.parse_ref(path)
+    return os.path.abspath(container) + (stem_container.REF_SEP + track if track is not None else "")
+
+
+def _track_key(mixture, stems):
+    """A track is its mixture; without one, its container or its stems' folder."""
+    if mixture:
+        return _key(mixture)
+    path, track = stem_container.parse_ref(next(iter(stems.values())))
+    return os.path.abspath(path if track is not None else os.path.dirname(path))
+
+
+# ==========================================
+# DIRECTORY LAYOUTS
+# ==========================================
+def group_folder(folder, names):
+    """
+    Tracks in one directory listing: every .stems container, plus the loose
+    stem files (newest per stem) with their mixture if there is one.
+    Returns a list of (name, mixture or None, {stem: path}).
+    """
+    groups = []
+    stems, mixture = {}, None
+    for name in sorted(names):
+        path = os.path.join(folder, name)
+        base, ext = os.path.splitext(name)
+        if ext == ".stems":
+            tracks = stem_container.open_container(path).tracks
+            groups.append((base, stem_container.make_ref(path, "Mixture") if "Mixture" in tracks else None,
+                           {s: stem_container.make_ref(path, s) for s in STEMS if s in tracks}))
+            continue
+        if ext.lower() not in AUDIO_EXTENSIONS:
+            continue
+        match = STEM_PATTERN.match(name)
+        if match:
+            stem = match.group(1).title()
+            if stem not in stems or os.path.getmtime(path) > os.path.getmtime(stems[stem]):
+                stems[stem] = path
+        elif base.lower() in MIXTURE_NAMES:
+            mixture = path
+    if stems:
+        title = os.path.basename(os.path.abspath(folder))
+        groups.append((title, mixture, {s: stems[s] for s in STEMS if s in stems}))
+    return groups
+
+
+def read_manifest(path):
+    """Finished tracks of a batch_separate manifest: (name, input file, {stem: path})."""
+    done = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted batch run
+                continue
+            if record.get("status") == "done":
+                done[record["track"]] = record["outputs"]
+    return [(os.path.splitext(os.path.basename(track))[0], track, outputs) for track, outputs in done.items()]
+
+
+# ==========================================
+# LIBRARY
+# ==========================================
+class TrackLibrary:
+    """
+    SQLite index of separated tracks: mixture, stems, duration, sample rate,
+    loudness and the content digests / cache keys of their features.
+
+    Files are re-read only when their size or mtime changed, so re-indexing a
+    folder of unchanged tracks costs one stat() per file. Listing, searching
+    and opening a track are index lookups; opening one also seeds the feature
+    cache's digest memo, so its cached features load without re-hashing.
+    Safe to share between threads; several processes may use the same file.
+    """
+
+    def __init__(self, path=LIBRARY_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------
+    # Indexing
+    # ------------------------------------------
+    def _file_row(self, path):
+        """Stored metadata of `path`, refreshed if the file changed since it was indexed."""
+        key = _key(path)
+        size, mtime_ns = _stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT * FROM files WHERE path = ?", (key,)).fetchone()
+        if row is not None and row["size"] == size and row["mtime_ns"] == mtime_ns:
+            return dict(row), False
+        meta = file_metadata(path)
+        return dict(meta, path=key, size=size, mtime_ns=mtime_ns), True
+
+    def add_track(self, name, mixture, stems, features=False):
+        """
+        Indexes (or refreshes) one track: `mixture` is its input file (or None),
+        `stems` {stem: path}. Unchanged files are not read again. With
+        `features`, the waveform peaks of changed files are computed into the
+        feature cache and their keys recorded. Returns the track id.
+        """
+        if not stems:
+            raise ValueError(f"Track {name!r} has no stems")
+        track_key = _track_key(mixture, stems)
+        roles = dict(stems, **({"Mixture": mixture} if mixture else {}))
+        rows = {}
+        changed = []
+        for role, path in roles.items():
+            rows[role], fresh = self._file_row(path)
+            if fresh:
+                changed.append(path)
+        if features:
+            import waveform_peaks
+            for path in changed:
+                waveform_peaks.peak_levels(path)
+
+        main = rows.get("Mixture") or rows[next(iter(stems))]
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO tracks (key, name, mixture, duration, samplerate, channels, loudness_db, added, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET name = excluded.name, mixture = excluded.mixture,"
+                " duration = excluded.duration, samplerate = excluded.samplerate, channels = excluded.channels,"
+                " loudness_db = excluded.loudness_db, updated = excluded.updated",
+                (track_key, name, _key(mixture) if mixture else None, main["duration"], main["samplerate"],
+                 main["channels"], main["loudness_db"], now, now))
+            track_id = self._db.execute("SELECT id FROM tracks WHERE key = ?", (track_key,)).fetchone()[0]
+            self._db.execute("DELETE FROM files WHERE track_id = ? AND path NOT IN (%s)"
+                             % ",".join("?" * len(rows)), (track_id, *(r["path"] for r in rows.values())))
+            for role, r in rows.items():
+                # An upsert, not REPLACE: deleting the row would cascade to its features
+                self._db.execute(
+                    "INSERT INTO files (path, track_id, role, size, mtime_ns, digest, duration,"
+                    " samplerate, channels, loudness_db) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (path) DO UPDATE SET track_id = excluded.track_id, role = excluded.role,"
+                    " size = excluded.size, mtime_ns = excluded.mtime_ns, digest = excluded.digest,"
+                    " duration = excluded.duration, samplerate = excluded.samplerate,"
+                    " channels = excluded.channels, loudness_db = excluded.loudness_db",
+                    (r["path"], track_id, role, r["size"], r["mtime_ns"], r["digest"], r["duration"],
+                     r["samplerate"], r["channels"], r["loudness_db"]))
+            if features:
+                import waveform_peaks
+                for path in changed:
+                    self._db.execute("INSERT OR REPLACE INTO features (path, kind, cache_key) VALUES (?, ?, ?)",
+                                     (_key(path), "peaks",
+                                      feature_cache.cache_key(path, "peaks", **waveform_peaks.PARAMS)))
+        return track_id
+
+    def scan(self, root, recursive=True, features=False):
+        """
+        Indexes every track under `root` (see group_folder; batch manifests give
+        separated stems their input file) and drops tracks whose files are gone.
+        Hidden directories such as .cache are skipped. Returns the track ids.
+        """
+        ids, claimed = [], set()
+        for folder, dirs, names in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".")) if recursive else []
+            if MANIFEST_NAME in names:
+                for name, mixture, stems in read_manifest(os.path.join(folder, MANIFEST_NAME)):
+                    if all(os.path.exists(p) for p in [mixture, *stems.values()]):
+                        ids.append(self.add_track(name, mixture, stems, features))
+                        claimed.update(_key(p) for p in stems.values())
+            for name, mixture, stems in group_folder(folder, names):
+                if stems and not all(_key(p) in claimed for p in stems.values()):
+                    ids.append(self.add_track(name, mixture, stems, features))
+        self.prune()
+        return ids
+
+    def set_container(self, track_id, container):
+        """Records the packed stem container of a track (see stem_container.packed)."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE tracks SET container = ? WHERE id = ?", (container, track_id))
+
+    def prune(self):
+        """Removes tracks with a missing file. Returns how many were removed."""
+        with self._lock:
+            rows = self._db.execute("SELECT path, track_id FROM files").fetchall()
+        gone = {r["track_id"] for r in rows if not os.path.exists(stem_container.parse_ref(r["path"])[0])}
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM tracks WHERE id = ?", [(i,) for i in gone])
+        return len(gone)
+
+    # ------------------------------------------
+    # Queries
+    # ------------------------------------------
+    def count(self, query=None):
+        with self._lock:
+            if query:
+                return self._db.execute("SELECT COUNT(*) FROM tracks WHERE name LIKE ? ESCAPE '\\'",
+                                        (_like(query),)).fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def tracks(self, query=None, limit=100, offset=0):
+        """Tracks whose name contains `query` (case-insensitive), by name: a list of dicts."""
+        sql = "SELECT * FROM tracks"
+        args = []
+        if query:
+            sql += " WHERE name LIKE ? ESCAPE '\\'"
+            args.append(_like(query))
+        sql += " ORDER BY name COLLATE NOCASE, id LIMIT ? OFFSET ?"
+        with self._lock:
+            return [dict(r) for r in self._db.execute(sql, (*args, limit, offset))]
+
+    def get(self, track_id):
+        """
+        One track with its files, or None: the track's row plus "stems"
+        ({stem: path} in STEMS order) and "files" ({role: file row}).
+        """
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tracks WHERE id = ?", (track_id,)).fetchone()
+            if row is None:
+                return None
+            files = {r["role"]: dict(r) for r in
+                     self._db.execute("SELECT * FROM files WHERE track_id = ?", (track_id,))}
+            features = self._db.execute(
+                "SELECT features.* FROM features JOIN files ON files.path = features.path"
+                " WHERE files.track_id = ?", (track_id,)).fetchall()
+        files_by_path = {f["path"]: f for f in files.values()}
+        for r in features:
+            files_by_path[r["path"]].setdefault("features", {})[r["kind"]] = r["cache_key"]
+        for f in files.values():
+            # Container tracks hash through their container, whose digest is not stored
+            if stem_container.parse_ref(f["path"])[1] is None:
+                feature_cache.remember_digest(f["path"], f["size"], f["mtime_ns"], f["digest"])
+        track = dict(row)
+        track["files"] = files
+        track["stems"] = {s: files[s]["path"] for s in STEMS if s in files}
+        return track
+
+
+def _like(query):
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index separated tracks into the SpecTacles track library.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    scan_p = sub.add_parser("scan", help="Index (or refresh) every track under the given folders")
+    scan_p.add_argument("roots", nargs="+")
+    scan_p.add_argument("--features", action="store_true", help="Also precompute waveform peaks")
+    list_p = sub.add_parser("list", help="List (or search) indexed tracks")
+    list_p.add_argument("query", nargs="?")
+    list_p.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--library", default=LIBRARY_PATH)
+    args = parser.parse_args()
+
+    with TrackLibrary(args.library) as library:
+        if args.command == "scan":
+            for root in args.roots:
+                started = time.time()
+                ids = library.scan(root, features=args.features)
+                print(f"{root}: {len(ids)} tracks indexed in {time.time() - started:.1f}s")
+            print(f"Library: {library.count()} tracks ({args.library})")
+        else:
+            for t in library.tracks(args.query, args.limit):
+                loudness = f"{t['loudness_db']:.1f} dBFS" if t["loudness_db"] is not None else "-"
+                print(f"{t['id']:>6}  {t['name']:<40} {t['duration']:7.1f}s  {t['samplerate']} Hz  {loudness}")
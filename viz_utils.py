@@ -1,83 +1,336 @@
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+import feature_cache as cache
+import spectral
+import decimate
+import spectrogram_tiles as tiles
+import stem_container
+from analysis import default_n_fft
+from profiling import stage
+
+def _window(start, end):
+    """Cache parameters of a [start, end] seconds window; none for the whole track."""
+    if start is None and end is None:
+        return {}
+    return {"start": None if start is None else round(float(start), 3),
+            "end": None if end is None else round(float(end), 3)}
+
+@stage("decode")
+def _decode(audio_path, sr, start=None, end=None):
+    y, native_sr = stem_container.read(audio_path, start=start, end=end, mono=True)
+    if sr == native_sr:
+        return y
+    import librosa
+    return librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+
+def load_audio(audio_path, sr=None, start=None, end=None):
+    """
+    Decodes an audio file (or stem container track) to mono PCM at `sr`
+    (native rate if None), served from the feature cache after the first call.
+    With `start`/`end` (seconds) only that region is returned: sliced from the
+    cached full decode when there is one, otherwise decoded with a seek.
+    """
+    sr = sr or stem_container.info(audio_path)[0]
+    params = {"sr": sr}
+    if not _window(start, end):
+        y = cache.cached_array(audio_path, "pcm", params, lambda: _decode(audio_path, sr))
+        return y, sr
+    full = cache.load_array(cache.cache_key(audio_path, "pcm", **params))
+    if full is not None:
+        a = 0 if start is None else int(start * sr)
+        b = len(full) if end is None else int(np.ceil(end * sr))
+        return full[a:b], sr
+    return _decode(audio_path, sr, start, end), sr
+
+def _span(audio_path, start, end):
+    """(start, end), or (None, None) when the window covers the whole track, so both share its cache entries."""
+    if (start or 0) <= 0 and (end is None or end >= audio_duration(audio_path)):
+        return None, None
+    return start, end
+
+def analysis_params(audio_path):
+    """
+    STFT layout of a file's analysis at its native rate: ~93 ms frames, 75% overlap.
+    """
+    sr = stem_container.info(audio_path)[0]
+    n_fft = default_n_fft(sr)
+    return {"sr": sr, "n_fft": n_fft, "hop_length": n_fft // 4}
+
+def mel_db(audio_path, n_mels=128, fmax=8000, start=None, end=None):
+    """
+    Returns the Mel-Spectrogram of a file (or of its [start, end] seconds window) in dB (cached).
+    The file is streamed block by block: only the mel power is kept in memory,
+    and the PSD of the same STFT is cached alongside when psd_curve has none yet.
+    """
+    start, end = _span(audio_path, start, end)
+    keys = _feature_keys(audio_path, start, end, n_mels, fmax)
+    S_dB = cache.load_array(keys["mel_db"])
+    if S_dB is None:
+        todo = {kind: key for kind, key in keys.items() if kind == "mel_db" or not cache.contains(key)}
+        S_dB = _compute_features({audio_path: todo}, start, end, n_mels, fmax)[audio_path]["mel_db"]
+    return S_dB
+
+def psd_curve(audio_path, n_bins=512, start=None, end=None):
+    """
+    Returns (log-spaced freqs, PSD dB) of the file or of its [start, end]
+    seconds window: the Welch average of its analysis STFT frames (cached).
+    """
+    start, end = _span(audio_path, start, end)
+    key = cache.cache_key(audio_path, "welch_psd", **_psd_params(audio_path, n_bins, start, end))
+    arrays = cache.load_arrays(key)
+    if arrays is None:
+        arrays = _compute_features({audio_path: {"psd": key}}, start, end, n_bins=n_bins)[audio_path]["psd"]
+    return arrays["freqs"], arrays["db"]
+
+def _mel_params(audio_path, n_mels, fmax, start=None, end=None):
+    return dict(analysis_params(audio_path), n_mels=n_mels, fmax=fmax, **_window(start, end))
+
+def _psd_params(audio_path, n_bins, start=None, end=None):
+    return dict(analysis_params(audio_path), n_bins=n_bins, **_window(start, end))
 
-def plot_spectrogram(audio_path, title="Spectrogram"):
+def _feature_keys(audio_path, start, end, n_mels=128, fmax=8000, n_bins=512):
+    """Cache keys of the PSD and Mel-Spectrogram of a file's window, as psd_curve and mel_db store them."""
+    return {"psd": cache.cache_key(audio_path, "welch_psd", **_psd_params(audio_path, n_bins, start, end)),
+            "mel_db": cache.cache_key(audio_path, "mel_db", **_mel_params(audio_path, n_mels, fmax, start, end))}
+
+def plot_spectrogram(audio_path, title="Spectrogram", start=None, end=None):
     """
-    Generates a high-quality Mel-Spectrogram using Librosa and Matplotlib.
+    Generates a high-quality Mel-Spectrogram using Librosa and Matplotlib,
+    of the whole track or of its [start, end] seconds window.
     Returns the matplotlib figure.
     """
-    y, sr = librosa.load(audio_path)
-    
-    # Compute Mel Spectrogram
-    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=8000)
-    S_dB = librosa.power_to_db(S, ref=np.max)
+    # librosa.display pulls in matplotlib: only pay for it when this view is used
+    import librosa
+    import librosa.display
+    import matplotlib.pyplot as plt
+
+    params = analysis_params(audio_path)
+    S_dB = mel_db(audio_path, n_mels=128, fmax=8000, start=start, end=end)
+    times = librosa.times_like(S_dB, sr=params["sr"], hop_length=params["hop_length"]) + (start or 0)
 
     # Plot
-    fig, ax = plt.subplots(figsize=(10, 4))
-    img = librosa.display.specshow(S_dB, x_axis='time', y_axis='mel', sr=sr, fmax=8000, ax=ax, cmap='magma')
-    fig.colorbar(img, ax=ax, format='%+2.0f dB')
-    ax.set_title(title, fontsize=14, color='white')
+    with stage("figure"):
+        fig, ax = plt.subplots(figsize=(10, 4))
+        img = librosa.display.specshow(S_dB, x_coords=times, x_axis='time', y_axis='mel', sr=params["sr"],
+                                       hop_length=params["hop_length"], fmax=8000, ax=ax, cmap='magma')
+        fig.colorbar(img, ax=ax, format='%+2.0f dB')
+        ax.set_title(title, fontsize=14, color='white')
     
-    # Style for Dark Mode
-    fig.patch.set_facecolor('#09090b') # Zinc-950
-    ax.set_facecolor('#09090b')
-    ax.tick_params(axis='x', colors='white')
-    ax.tick_params(axis='y', colors='white')
-    ax.yaxis.label.set_color('white')
-    ax.xaxis.label.set_color('white')
+        # Style for Dark Mode
+        fig.patch.set_facecolor('#09090b') # Zinc-950
+        ax.set_facecolor('#09090b')
+        ax.tick_params(axis='x', colors='white')
+        ax.tick_params(axis='y', colors='white')
+        ax.yaxis.label.set_color('white')
+        ax.xaxis.label.set_color('white')
     
-    plt.tight_layout()
+        plt.tight_layout()
     return fig
 
-def plot_before_after_psd(orig_path, stem_path, stem_name):
+def audio_duration(audio_path):
     """
-    Plots the Power Spectral Density (PSD) comparison.
-    Shows how much energy was removed/retained at each frequency.
+    Track length in seconds, read from the file header (no decode).
     """
-    y_orig, sr = librosa.load(orig_path)
-    y_stem, _ = librosa.load(stem_path)
-    
-    # Ensure same length
-    min_len = min(len(y_orig), len(y_stem))
-    y_orig = y_orig[:min_len]
-    y_stem = y_stem[:min_len]
+    return stem_container.info(audio_path)[1]
+
+def plot_spectrogram_view(audio_path, title="Spectrogram", start=None, end=None,
+                          chart_width=decimate.DEFAULT_CHART_WIDTH):
+    """
+    Interactive Mel-Spectrogram of the [start, end] seconds window at the
+    resolution that fits the chart. The whole track (or any window, once it
+    exists) comes from the cached uint8 tile pyramid; other windows are
+    analysed on their own, so their cost scales with the window length.
+    Returns a Plotly figure.
+    """
+    n_mels, fmax = 128, 8000
+    params = _mel_params(audio_path, n_mels, fmax)
+    sr, hop_length = params["sr"], params["hop_length"]
+    compute_mel = lambda: np.asarray(mel_db(audio_path, n_mels=n_mels, fmax=fmax))
+
+    whole = (start or 0) <= 0 and (end is None or end >= audio_duration(audio_path))
+    if whole or tiles.is_built(audio_path, params):
+        start_frame = 0 if start is None else int(start * sr / hop_length)
+        end_frame = np.iinfo(np.int32).max if end is None else int(np.ceil(end * sr / hop_length))
+        with stage("tiles"):
+            q, level, first_frame = tiles.load_window(audio_path, params, compute_mel,
+                                                      start_frame, end_frame, max_cols=chart_width)
+        times = (first_frame + np.arange(q.shape[1]) * 2 ** level) * hop_length / sr
+    else:
+        S_dB = mel_db(audio_path, n_mels=n_mels, fmax=fmax, start=start, end=end)
+        with stage("tiles"):
+            q, level = tiles.reduce(S_dB, max_cols=chart_width)
+        times = (start or 0) + np.arange(q.shape[1]) * 2 ** level * hop_length / sr
+
+    # Label the mel bins with their centre frequency in Hz
+    with stage("figure"):
+        import librosa
+        mel_freqs = librosa.mel_frequencies(n_mels=n_mels, fmax=fmax)
+        tick_hz = [128, 256, 512, 1024, 2048, 4096, 8000]
+        tick_bins = [int(np.argmin(np.abs(mel_freqs - hz))) for hz in tick_hz]
+        tick_db = np.arange(tiles.DB_FLOOR, 1, 20)
+
+        fig = go.Figure(go.Heatmap(
+            z=q, x=times, y=np.arange(n_mels),
+            colorscale='Magma', zmin=0, zmax=255,
+            colorbar=dict(tickvals=tiles.quantize(tick_db).tolist(),
+                          ticktext=[f"{db:+.0f} dB" for db in tick_db]),
+            hovertemplate="%{x:.2f}s<extra></extra>"
+        ))
+        fig.update_layout(
+            title=title,
+            xaxis_title="Time (s)",
+            yaxis_title="Hz",
+            yaxis=dict(tickvals=tick_bins, ticktext=[str(hz) for hz in tick_hz]),
+            template="plotly_dark",
+            plot_bgcolor='#09090b',
+            paper_bgcolor='#09090b',
+            font=dict(family="Figtree, sans-serif")
+        )
+    return fig
 
-    # Compute FFT
-    fft_orig = np.abs(np.fft.rfft(y_orig))
-    fft_stem = np.abs(np.fft.rfft(y_stem))
-    freqs = np.fft.rfftfreq(min_len, 1/sr)
+def plot_before_after_psd(orig_path, stem_path, stem_name, chart_width=decimate.DEFAULT_CHART_WIDTH,
+                          start=None, end=None):
+    """
+    Plots the Power Spectral Density (PSD) comparison over the whole track or
+    its [start, end] seconds window.
+    Shows how much energy was removed/retained at each frequency.
+    Traces are decimated to what a `chart_width`-pixel chart can display.
+    """
+    # Welch-averaged spectra on a shared log-frequency grid
+    freqs, db_orig = psd_curve(orig_path, start=start, end=end)
+    freqs_stem, db_stem = psd_curve(stem_path, start=start, end=end)
+    with stage("decimate"):
+        freqs, db_orig = decimate.decimate_series(freqs, db_orig, chart_width, log_x=True)
+        freqs_stem, db_stem = decimate.decimate_series(freqs_stem, db_stem, chart_width, log_x=True)
 
     # Plotly Interactive Figure
-    fig = go.Figure()
+    with stage("figure"):
+        fig = go.Figure()
     
-    # Original (Faded)
-    fig.add_trace(go.Scatter(
-        x=freqs, y=20*np.log10(fft_orig + 1e-6),
-        mode='lines', name='Original Mix',
-        line=dict(color='gray', width=1),
-        opacity=0.5
-    ))
+        # Original (Faded)
+        fig.add_trace(go.Scatter(
+            x=freqs, y=db_orig,
+            mode='lines', name='Original Mix',
+            line=dict(color='gray', width=1),
+            opacity=0.5
+        ))
     
-    # Stem (Pop color)
-    color_map = {'Vocals': '#3b82f6', 'Drums': '#ef4444', 'Bass': '#eab308', 'Other': '#22c55e'}
-    fig.add_trace(go.Scatter(
-        x=freqs, y=20*np.log10(fft_stem + 1e-6),
-        mode='lines', name=f'Isolated {stem_name}',
-        line=dict(color=color_map.get(stem_name, 'white'), width=2)
-    ))
-
-    fig.update_layout(
-        title=f"Spectral Analysis: {stem_name} Isolation",
-        xaxis_title="Frequency (Hz)",
-        yaxis_title="Power (dB)",
-        xaxis_type="log",
-        template="plotly_dark",
-        plot_bgcolor='#09090b',
-        paper_bgcolor='#09090b',
-        font=dict(family="Figtree, sans-serif")
-    )
+        # Stem (Pop color)
+        color_map = {'Vocals': '#3b82f6', 'Drums': '#ef4444', 'Bass': '#eab308', 'Other': '#22c55e'}
+        fig.add_trace(go.Scatter(
+            x=freqs_stem, y=db_stem,
+            mode='lines', name=f'Isolated {stem_name}',
+            line=dict(color=color_map.get(stem_name, 'white'), width=2)
+        ))
+
+        fig.update_layout(
+            title=f"Spectral Analysis: {stem_name} Isolation",
+            xaxis_title="Frequency (Hz)",
+            yaxis_title="Power (dB)",
+            xaxis_type="log",
+            template="plotly_dark",
+            plot_bgcolor='#09090b',
+            paper_bgcolor='#09090b',
+            font=dict(family="Figtree, sans-serif")
+        )
     return fig
+
+# ==========================================
+# BATCHED MULTI-STEM FEATURES
+# ==========================================
+def _n_samples(audio_path, start, end):
+    """Samples in the [start, end] seconds window of a file, as stem_container.blocks reads it."""
+    sr, duration = stem_container.info(audio_path)
+    total = int(round(duration * sr))
+    a = 0 if start is None else min(total, int(start * sr))
+    b = total if end is None else min(total, int(np.ceil(end * sr)))
+    return max(0, b - a)
+
+def _stacked_blocks(audio_paths, blocksize, start, end, pool):
+    """
+    The files' windows as (k, blocksize) mono blocks, the k files read
+    concurrently on `pool`; a file that ends early is zero-padded.
+    """
+    def read_next(it):
+        return next(it, None)
+    streams = [stem_container.blocks(p, blocksize, *_span(p, start, end), mono=True) for p in audio_paths]
+    while True:
+        blocks = list(pool.map(lambda it: contextvars.copy_context().run(read_next, it), streams))
+        if all(b is None for b in blocks):
+            return
+        n = max(len(b) for b in blocks if b is not None)
+        yield np.stack([np.zeros(n, np.float32) if b is None else np.pad(b, (0, n - len(b)))
+                        for b in blocks])
+
+def features(audio_paths, start=None, end=None, n_mels=128, fmax=8000, n_bins=512, mel_paths=None):
+    """
+    Computes the PSD of every file, and the Mel-Spectrogram of those in
+    `mel_paths` (default: all), over the same window, in one pass: files with
+    the same analysis layout and length (a mixture and its stems) are read
+    concurrently, block by block, and each (k, n) block of the stack goes
+    through one windowed FFT that both features share. Blocks shrink as the
+    stack grows, so the working memory stays at the single-file level; only
+    the mel power of the rows that need it is kept. Results are stored under
+    the mel_db / psd_curve cache entries, where the views find them; files
+    whose entries exist already are not read at all.
+    """
+    mel_paths = set(audio_paths if mel_paths is None else mel_paths)
+    todo = {}
+    for path in audio_paths:
+        keys = _feature_keys(path, *_span(path, start, end), n_mels, fmax, n_bins)
+        missing = {kind: key for kind, key in keys.items()
+                   if (kind == "psd" or path in mel_paths) and not cache.contains(key)}
+        if missing:
+            todo[path] = missing
+    if todo:
+        _compute_features(todo, start, end, n_mels, fmax, n_bins)
+
+def _compute_features(todo, start=None, end=None, n_mels=128, fmax=8000, n_bins=512):
+    """
+    Computes and caches the features `todo` asks for ({path: {"psd" /
+    "mel_db": cache key}}) over the window, batching files of the same layout
+    and length (see features()). Returns {path: {"psd": {"freqs", "db"},
+    "mel_db": array}} for what was computed.
+    """
+    groups = {}
+    for path in todo:
+        layout = tuple(sorted(analysis_params(path).items()))
+        groups.setdefault((layout, _n_samples(path, start, end)), []).append(path)
+
+    results = {path: {} for path in todo}
+    with ThreadPoolExecutor(max(len(m) for m in groups.values())) as pool:
+        for (layout, _), members in groups.items():
+            params = dict(layout)
+            mel_rows = [i for i, p in enumerate(members) if "mel_db" in todo[p]]
+            stft = spectral.MelSpectrogram(params["sr"], params["n_fft"], params["hop_length"], n_mels, fmax,
+                                           mel_rows=mel_rows)
+            frames_per_block = max(16, spectral.FRAMES_PER_BLOCK // len(members))
+            for block in _stacked_blocks(members, frames_per_block * params["hop_length"], start, end, pool):
+                with stage("features"):
+                    stft.feed(block)
+            with stage("features"):
+                freqs, psd_db = stft.psd(n_bins)
+                for i, path in enumerate(members):
+                    if "psd" in todo[path]:
+                        results[path]["psd"] = {"freqs": freqs, "db": psd_db[i]}
+                        cache.save_arrays(todo[path]["psd"], **results[path]["psd"])
+                if mel_rows:
+                    mel_db_rows = stft.result().astype(np.float32)
+                    for row, i in enumerate(mel_rows):
+                        results[members[i]]["mel_db"] = mel_db_rows[row]
+                        cache.save_array(todo[members[i]]["mel_db"], mel_db_rows[row])
+    return results
+
+def prefetch_views(mix_path, stem_paths, start=None, end=None):
+    """
+    Batches what the Spectral Lab views of these stems need for the window:
+    every PSD, and the Mel-Spectrograms the spectrogram view will read (the
+    whole track's, or the window's where no tile pyramid covers it yet).
+    """
+    mel_paths = [p for p in stem_paths if _span(p, start, end) == (None, None)
+                 or not tiles.is_built(p, _mel_params(p, 128, 8000))]
+    features([mix_path, *stem_paths], start, end, mel_paths=mel_paths)
@@ -0,0 +1,61 @@
+import numpy as np
+
+import feature_cache as cache
+import stem_container
+
+# Samples per peak at the finest level (~5.8 ms at 44.1 kHz); every further
+# level halves the resolution until the whole track fits in MIN_PEAKS.
+BASE_SAMPLES = 256
+MIN_PEAKS = 512
+BLOCK_PEAKS = 4096
+PARAMS = {"base": BASE_SAMPLES, "min": MIN_PEAKS}
+
+
+def _base_peaks(audio_path):
+    """
+    Max |amplitude| over every BASE_SAMPLES samples of a file or stem
+    container track, streamed block by block.
+    """
+    chunks = []
+    for block in stem_container.blocks(audio_path, BASE_SAMPLES * BLOCK_PEAKS):
+        env = np.abs(block).max(axis=1)
+        pad = -len(env) % BASE_SAMPLES
+        if pad:
+            env = np.pad(env, (0, pad))
+        chunks.append(env.reshape(-1, BASE_SAMPLES).max(axis=1))
+    return np.concatenate(chunks) if chunks else np.zeros(1, dtype=np.float32)
+
+
+def _halve(peaks):
+    if len(peaks) % 2:
+        peaks = np.append(peaks, peaks[-1])
+    return np.maximum(peaks[0::2], peaks[1::2])
+
+
+def compute_levels(audio_path):
+    levels = [_base_peaks(audio_path)]
+    while len(levels[-1]) > MIN_PEAKS:
+        levels.append(_halve(levels[-1]))
+    # float16 is plenty for drawing and halves the cache footprint
+    return {f"level{i}": p.astype(np.float16) for i, p in enumerate(levels)}
+
+
+def peak_levels(audio_path):
+    """
+    Multi-resolution peak envelope of an audio file (cached): a list of
+    arrays, level i holding one peak per BASE_SAMPLES * 2**i samples.
+    """
+    arrays = cache.cached_arrays(audio_path, "peaks", PARAMS, lambda: compute_levels(audio_path))
+    return [arrays[f"level{i}"] for i in range(len(arrays))]
+
+
+def peaks_for_width(audio_path, n_points):
+    """
+    The coarsest level with at least `n_points` peaks (or the finest one),
+    as a float32 array in [0, 1].
+    """
+    levels = peak_levels(audio_path)
+    for level in reversed(levels):
+        if len(level) >= n_points:
+            return level.astype(np.float32)
+    return levels[0].astype(np.float32)